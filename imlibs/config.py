@@ -4,6 +4,51 @@ class _Config():
     TEMPLATE = {
         "retry": 5,
         "cache_dir": os.getcwd() + "/cache",
+        "full_resolution": False,
+        "recursive": {
+            "workers": 8,
+            "skip_hidden": True,
+            "exclude": ["@eaDir", "$RECYCLE.BIN", "System Volume Information"]
+        },
+        "memory": {
+            "budget_mb": 512,
+            "low_memory_mb": 512
+        },
+        "readahead": {
+            "enable": True,
+            "mode": "read",
+            "workers": 4,
+            "min_window": 4,
+            "max_window": 48,
+            "decode_window": 2,
+            "fast_latency_ms": 5
+        },
+        "watch": {
+            "enable": True,
+            "delay": 200
+        },
+        "download": {
+            "workers": 8,
+            "timeout": 30
+        },
+        "probe": {
+            "enable": True,
+            "min_bytes": 1024,
+            "min_width": 48,
+            "min_height": 48
+        },
+        "session": {
+            "enable": True,
+            "file": os.getcwd() + "/session.json"
+        },
+        "fixture": {
+            "mode": "off",
+            "archive": os.getcwd() + "/fixtures",
+            "latency": 0.0,
+            "bandwidth": 0,
+            "error_rate": 0.0,
+            "seed": 0
+        },
         "proxy_config": {
             "enable": False,
             "proxy": {
@@ -33,7 +78,9 @@ class _Config():
             if not obj_dict or not isinstance(obj_dict, dict):
                 return default
             obj_dict = obj_dict.get(subkey)
-            
+        
+        if obj_dict is None:
+            return default
         return obj_dict
     
     def writeIntoConfig(self, obj):
@@ -0,0 +1,246 @@
+"""
+录制和回放HTTP请求，用于离线、可重复地测试网页模式的性能。
+录制的存档是一个目录：index.json记录每个请求的状态码和响应头，bodies目录保存响应内容
+"""
+import os, io, json, time, hashlib, threading, argparse, tempfile
+from http.client import responses
+from requests import Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .config import CONFIG
+
+# 响应内容保存的是解压后的数据，这些响应头回放时不再适用
+_DROPPED_HEADERS = ["content-encoding", "transfer-encoding", "connection", "keep-alive"]
+
+class FixtureArchive(object):
+    def __init__(self, archive_dir: str) -> None:
+        self.archive_dir = archive_dir
+        self.index_file = os.path.join(archive_dir, "index.json")
+        self.bodies_dir = os.path.join(archive_dir, "bodies")
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.index_file):
+            self.entries = json.load(open(self.index_file))
+
+    @staticmethod
+    def key(method: str, url: str, range_header: str = None) -> str:
+        if range_header:
+            return f"{method} {url} {range_header}"
+        return f"{method} {url}"
+
+    def get(self, method: str, url: str, range_header: str = None):
+        """
+        返回(status, headers, body)，不存在时返回None
+        """
+        entry = self.entries.get(self.key(method, url, range_header))
+        if entry is None:
+            return None
+        body = b""
+        if entry["body"]:
+            with open(os.path.join(self.bodies_dir, entry["body"]), "rb") as f:
+                body = f.read()
+        return entry["status"], entry["headers"], body
+
+    def put(self, method: str, url: str, range_header: str, status: int, headers: dict, body: bytes):
+        body_name = ""
+        if len(body) != 0:
+            body_name = hashlib.sha1(body).hexdigest()
+        headers = {name: value for (name, value) in headers.items() if name.lower() not in _DROPPED_HEADERS}
+        if method != "HEAD":
+            headers["Content-Length"] = str(len(body))
+
+        with self.lock:
+            os.makedirs(self.bodies_dir, exist_ok=True)
+            if body_name and not os.path.exists(os.path.join(self.bodies_dir, body_name)):
+                with open(os.path.join(self.bodies_dir, body_name), "wb") as f:
+                    f.write(body)
+            self.entries[self.key(method, url, range_header)] = {
+                "status": status, "headers": headers, "body": body_name}
+            # 每次录制后立即写入索引，中途退出时也能保留已经录制的内容
+            tmp_file = self.index_file + ".tmp"
+            json.dump(self.entries, open(tmp_file, "w"), indent=1)
+            os.replace(tmp_file, self.index_file)
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    正常发出请求，同时把响应写入存档
+    """
+    def __init__(self, archive: FixtureArchive, **kwargs) -> None:
+        kwargs.setdefault("pool_maxsize", 32)
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        body = response.content if request.method != "HEAD" else b""
+        self.archive.put(request.method, request.url, request.headers.get("Range"),
+                         response.status_code, dict(response.headers), body)
+        return response
+
+class ReplayAdapter(BaseAdapter):
+    """
+    从存档中返回响应，可以模拟延迟(秒)、带宽(字节/秒，0表示不限制)和错误率。
+    是否出错只由种子和请求本身(方法、地址、Range、第几次请求)决定，与多线程下请求到达的顺序无关，保证每次回放结果一致
+    """
+    def __init__(self, archive: FixtureArchive, latency=0.0, bandwidth=0, error_rate=0.0, seed=0) -> None:
+        super().__init__()
+        self.archive = archive
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.seed = seed
+        self.attempts = {}  # (方法, 地址, Range) -> 已经请求的次数
+        self.link_free = 0.0  # 模拟的链路空闲的时刻，所有线程共用同一带宽
+        self.lock = threading.Lock()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if self.shouldFail(request):
+            return self.buildResponse(request, 503, {}, b"")
+
+        range_header = request.headers.get("Range")
+        recorded = self.archive.get(request.method, request.url, range_header)
+        if recorded is None and (request.method == "HEAD" or range_header):
+            # 没有录制HEAD或Range请求时，从完整的GET响应中生成
+            recorded = self.archive.get("GET", request.url)
+            if recorded is not None:
+                recorded = self.sliceResponse(request.method, range_header, *recorded)
+        if recorded is None:
+            return self.buildResponse(request, 404, {}, b"")
+
+        status, headers, body = recorded
+        if self.bandwidth > 0 and len(body) != 0:
+            self.transmit(len(body))
+        return self.buildResponse(request, status, headers, body)
+
+    def transmit(self, nbytes: int):
+        """
+        按带宽在共用链路上依次预约传输时间(不允许突发的令牌桶)，多个线程同时下载时总吞吐量仍为bandwidth
+        """
+        with self.lock:
+            start = max(time.monotonic(), self.link_free)
+            self.link_free = start + nbytes / self.bandwidth
+            done = self.link_free
+        time.sleep(max(done - time.monotonic(), 0))
+
+    def shouldFail(self, request) -> bool:
+        if self.error_rate <= 0:
+            return False
+        key = (request.method, request.url, request.headers.get("Range"))
+        with self.lock:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+        # 同一个请求的重试次数不同，结果也不同，重试仍有机会成功
+        digest = hashlib.sha1(repr((self.seed,) + key + (attempt,)).encode()).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64 < self.error_rate
+
+    def sliceResponse(self, method, range_header, status, headers, body):
+        headers = dict(headers)
+        headers["Content-Length"] = str(len(body))
+        if method == "HEAD":
+            return status, headers, b""
+
+        units, _, byte_range = range_header.partition("=")
+        start, _, end = byte_range.partition("-")
+        if units.strip() != "bytes" or not start.isdigit():
+            return status, headers, body
+        start = int(start)
+        end = min(int(end), len(body) - 1) if end.isdigit() else len(body) - 1
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+        headers["Content-Length"] = str(max(end - start + 1, 0))
+        return 206, headers, body[start:end + 1]
+
+    def buildResponse(self, request, status: int, headers: dict, body: bytes) -> Response:
+        response = Response()
+        response.status_code = status
+        response.reason = responses.get(status, "")
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+def installFixtureAdapter(session, mode=None, archive=None, latency=None, bandwidth=None, error_rate=None, seed=None):
+    """
+    按照配置fixture.*(或参数)为session挂载录制/回放适配器，mode为off时不做任何修改
+    """
+    def option(value, key):
+        if value is not None:
+            return value
+        return CONFIG.getOrDefault(f"fixture.{key}", CONFIG.TEMPLATE['fixture'][key])
+
+    mode = option(mode, "mode")
+    if mode == "record":
+        adapter = RecordingAdapter(FixtureArchive(option(archive, "archive")))
+    elif mode == "replay":
+        adapter = ReplayAdapter(FixtureArchive(option(archive, "archive")),
+                                latency=option(latency, "latency"), bandwidth=option(bandwidth, "bandwidth"),
+                                error_rate=option(error_rate, "error_rate"), seed=option(seed, "seed"))
+    else:
+        return session
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def benchmark(url: str, timeout=600):
+    """
+    测量打开网页到第一张图片下载完成的时间，以及下载整个图集的吞吐量
+    """
+    from .network import RequestsHelper, FileDownloader, HTTPClient
+
+    start = time.perf_counter()
+    images = RequestsHelper(None).getImagesSrcFromURL(url) or []
+    parsed = time.perf_counter()
+
+    # 下载失败时不会回调，因此不等待第一张图片，而是轮询所有任务是否结束
+    first_image = []
+    downloader = FileDownloader(tempfile.mkdtemp(),
+                                lambda url, save_path: first_image.append(time.perf_counter()) if save_path else None)
+    for image_url in images:
+        downloader.addURL(HTTPClient(image_url))
+
+    while len(images) != 0 and time.perf_counter() - start < timeout:
+        finished = [job for job in downloader.jobs.values()
+                    if job.status in (FileDownloader.COMPLETED, FileDownloader.DOWNLOADFAILED)]
+        if len(finished) == len(images):
+            break
+        time.sleep(0.01)
+    end = time.perf_counter()
+    downloader.cancel()
+
+    completed = [job for job in downloader.jobs.values() if job.status == FileDownloader.COMPLETED]
+    total_bytes = sum([os.path.getsize(job.save_path) for job in completed])
+    return {
+        "images": len(images),
+        "completed": len(completed),
+        "parse_seconds": parsed - start,
+        # 没有任何图片下载成功时为None
+        "first_image_seconds": min(first_image) - start if len(first_image) != 0 else None,
+        "gallery_seconds": end - start,
+        "images_per_second": len(completed) / max(end - parsed, 1e-9),
+        "bytes_per_second": total_bytes / max(end - parsed, 1e-9),
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="WebBenchmark.py", description="录制/回放网页图片请求并测量性能")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("url")
+    parser.add_argument("--archive", default=None)
+    parser.add_argument("--latency", type=float, default=None, help="每个请求的延迟(秒)")
+    parser.add_argument("--bandwidth", type=int, default=None, help="带宽(字节/秒)")
+    parser.add_argument("--error-rate", type=float, default=None, help="返回503的比例")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from .network import createSession, setSession
+    setSession(installFixtureAdapter(createSession(), args.mode, args.archive, args.latency,
+                                     args.bandwidth, args.error_rate, args.seed))
+    print(json.dumps(benchmark(args.url), indent=1))
@@ -0,0 +1,135 @@
+import time, threading
+
+from .config import CONFIG
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+class MemoryBudget(object):
+    """
+    所有图片缓冲区(解码缓存、预览、统计等)的统一内存记账。
+    每个缓存先register(名称, 淘汰回调)，再为每个缓冲区charge字节数；
+    超出预算时按优先级淘汰：固定(pinned)的不淘汰，priority越大(如离当前图片越远)越先淘汰，
+    相同优先级先淘汰最久未使用的。系统可用内存不足时预算减半
+    """
+    class Entry:
+        def __init__(self, nbytes, priority, pinned, last_used) -> None:
+            self.nbytes = nbytes
+            self.priority = priority
+            self.pinned = pinned
+            self.last_used = last_used
+
+    def __init__(self, budget_bytes: int, low_memory_bytes: int) -> None:
+        self.budget_bytes = budget_bytes
+        self.low_memory_bytes = low_memory_bytes
+        self.lock = threading.RLock()
+        self.caches = {}   # 名称 -> 淘汰回调evict_cb(key)
+        self.entries = {}  # (名称, key) -> Entry
+        self.clock = 0
+        self.pressure = False
+        self.pressure_checked = 0
+
+    def register(self, name: str, evict_cb=None):
+        with self.lock:
+            self.caches[name] = evict_cb
+
+    def unregister(self, name: str):
+        with self.lock:
+            self.caches.pop(name, None)
+            for entry_key in [entry_key for entry_key in self.entries if entry_key[0] == name]:
+                del self.entries[entry_key]
+
+    def charge(self, name: str, key, nbytes: int, priority=0, pinned=False):
+        """
+        记录(或更新)一个缓冲区的大小，超出预算时立即淘汰其他缓冲区
+        """
+        with self.lock:
+            self.clock += 1
+            self.entries[(name, key)] = MemoryBudget.Entry(nbytes, priority, pinned, self.clock)
+        self.enforce()
+
+    def release(self, name: str, key):
+        with self.lock:
+            self.entries.pop((name, key), None)
+
+    def touch(self, name: str, key):
+        with self.lock:
+            entry = self.entries.get((name, key))
+            if entry:
+                self.clock += 1
+                entry.last_used = self.clock
+
+    def setPriority(self, name: str, key, priority=None, pinned=None):
+        with self.lock:
+            entry = self.entries.get((name, key))
+            if entry is None:
+                return
+            if priority is not None:
+                entry.priority = priority
+            if pinned is not None:
+                entry.pinned = pinned
+
+    def total(self) -> int:
+        with self.lock:
+            return sum([entry.nbytes for entry in self.entries.values()])
+
+    def usage(self) -> dict:
+        """
+        每个缓存当前占用的字节数
+        """
+        with self.lock:
+            usage = {name: 0 for name in self.caches}
+            for (name, _), entry in self.entries.items():
+                usage[name] = usage.get(name, 0) + entry.nbytes
+            return usage
+
+    def budget(self) -> int:
+        """
+        当前生效的预算，系统内存紧张时减半
+        """
+        now = time.monotonic()
+        if now - self.pressure_checked > 1:
+            self.pressure_checked = now
+            available = availableMemory()
+            self.pressure = available is not None and available < self.low_memory_bytes
+        return self.budget_bytes // 2 if self.pressure else self.budget_bytes
+
+    def enforce(self):
+        budget = self.budget()
+        evicted = []
+        with self.lock:
+            total = sum([entry.nbytes for entry in self.entries.values()])
+            if total <= budget:
+                return
+            candidates = sorted([(entry_key, entry) for (entry_key, entry) in self.entries.items() if not entry.pinned],
+                                key=lambda item: (-item[1].priority, item[1].last_used))
+            for entry_key, entry in candidates:
+                if total <= budget:
+                    break
+                del self.entries[entry_key]
+                total -= entry.nbytes
+                evicted.append((self.caches.get(entry_key[0]), entry_key[1]))
+        # 在锁外回调，避免回调中再次调用记账方法时死锁
+        for evict_cb, key in evicted:
+            if evict_cb:
+                evict_cb(key)
+
+def availableMemory() -> int:
+    """
+    系统可用内存字节数，无法获取时返回None
+    """
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+MEMORY = MemoryBudget(CONFIG.getOrDefault("memory.budget_mb", CONFIG.TEMPLATE['memory']['budget_mb']) * 1024 * 1024,
+                      CONFIG.getOrDefault("memory.low_memory_mb", CONFIG.TEMPLATE['memory']['low_memory_mb']) * 1024 * 1024)
@@ -1,12 +1,40 @@
-import requests, os
+import requests, os, threading, hashlib
 from typing import List
 from lxml import etree
-from urllib.parse import urljoin
-from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+from concurrent.futures import Future, CancelledError
+from requests.adapters import HTTPAdapter
 
 from .exceptions import RequestsModelException
 from .support import IMAGES
 from .config import CONFIG
+from .fixtures import installFixtureAdapter
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+POOL_MAXSIZE = 32  # 每个主机保持的连接数，需要不少于并发请求的线程数
+
+def createSession() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=POOL_MAXSIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def getSession() -> requests.Session:
+    """
+    所有请求共用的Session，配置了fixture.mode时挂载录制/回放适配器
+    """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = installFixtureAdapter(createSession())
+        return _SESSION
+
+def setSession(session: requests.Session):
+    global _SESSION
+    with _SESSION_LOCK:
+        _SESSION = session
 
 class HTTPClient(object):
     USER_AGENT = {
@@ -22,7 +50,7 @@ class HTTPClient(object):
 
     def doGet(self) -> str:
         try:
-            rs = requests.get(self.url, headers=self.headers, verify=False, proxies=self.proxy_config)
+            rs = getSession().get(self.url, headers=self.headers, verify=False, proxies=self.proxy_config)
         except Exception as e:
             raise RequestsModelException(e.args[0])
         if rs.status_code != 200:
@@ -36,11 +64,39 @@ class HTTPClient(object):
 class BrowserClient(object):
     pass
 
+class ImageCandidate(object):
+    """
+    同一张图片的一个候选地址，width为像素宽度，density为像素密度(1x, 2x)
+    """
+    def __init__(self, url: str, width: int = None, density: float = None, priority: int = 0) -> None:
+        self.url = url
+        self.width = width
+        self.density = density
+        self.priority = priority
+
 class RequestsHelper:
+    # 常见懒加载属性，越靠前越可能是真实图片地址
+    LAZY_ATTRS = ["data-original", "data-src", "data-lazy-src", "data-lazy",
+                  "data-actualsrc", "data-url", "data-echo", "src"]
+    SRCSET_ATTRS = ["srcset", "data-srcset", "data-lazy-srcset"]
+    SOURCE_TYPES = ["image/jpeg", "image/jpg", "image/png"]
+
     def __init__(self, proxy_config) -> None:
         self.proxy_config = proxy_config
 
-    def getImagesSrcFromURL(self, url, headers=None) -> List[str]:
+    def getImagesSrcFromURL(self, url, headers=None, target_width=None) -> List[str]:
+        """
+        每个img标签只选取一个地址，target_width为None时选取最高分辨率，
+        否则选取不小于target_width的最小版本
+        """
+        variants = self.getImageVariantsFromURL(url, headers)
+        if variants is None:
+            return None
+        
+        images = [self.chooseVariant(candidates, target_width) for candidates in variants]
+        return sorted(list(set(images)))
+
+    def getImageVariantsFromURL(self, url, headers=None) -> List[List[ImageCandidate]]:
         html = HTTPClient(url, headers, self.proxy_config).doGet()
         et = etree.HTML(html)
         if et is None:
@@ -52,26 +108,386 @@ class RequestsHelper:
             # HTML文档里没有img标签，可以尝试模拟浏览器
             return None
 
-        images = []
+        variants = []
         for img in imgs:
-            for (attr_name, attr_val) in img.items():
-                if self.isImageSuffix(attr_val):
-                    images.append(self.combineURL(url, img.get(attr_name)))
+            candidates = self.getCandidatesFromImg(url, img)
+            if len(candidates) != 0:
+                variants.append(candidates)
         
-        return sorted(list(set(images)))
+        return variants
+
+    def getCandidatesFromImg(self, url, img) -> List[ImageCandidate]:
+        candidates = []
+        base_width = parseInt(img.get("width"))
+        
+        # libxml2不认识picture标签，img可能被嵌套在source里，因此向上查找picture
+        picture = next(img.iterancestors("picture"), None)
+        if picture is not None:
+            for source in picture.iter("source"):
+                source_type = source.get("type")
+                if source_type and source_type.lower() not in self.SOURCE_TYPES:
+                    continue
+                for attr_name in self.SRCSET_ATTRS:
+                    candidates.extend(self.parseSrcset(url, source.get(attr_name), base_width))
+        
+        for attr_name in self.SRCSET_ATTRS:
+            candidates.extend(self.parseSrcset(url, img.get(attr_name), base_width))
+
+        lazy_found = False
+        for priority, attr_name in enumerate(self.LAZY_ATTRS):
+            attr_val = img.get(attr_name)
+            if attr_name == "src" and lazy_found:
+                # 有懒加载属性时src通常只是占位图
+                continue
+            if attr_val and self.isImageURL(attr_val):
+                lazy_found = True
+                candidates.append(ImageCandidate(
+                    self.combineURL(url, attr_val.strip()), width=base_width, priority=priority))
+        
+        for (attr_name, attr_val) in img.items():
+            if attr_name in self.LAZY_ATTRS or attr_name in self.SRCSET_ATTRS:
+                continue
+            if self.isImageSuffix(attr_val):
+                candidates.append(ImageCandidate(
+                    self.combineURL(url, attr_val.strip()), width=base_width, priority=len(self.LAZY_ATTRS)))
+        
+        return candidates
+
+    def parseSrcset(self, url: str, srcset: str, base_width: int = None) -> List[ImageCandidate]:
+        """
+        解析srcset属性，如"a.jpg 480w, b.jpg 2x"
+        """
+        candidates = []
+        if not srcset:
+            return candidates
+        
+        pos, length = 0, len(srcset)
+        while pos < length:
+            while pos < length and (srcset[pos].isspace() or srcset[pos] == ","):
+                pos += 1
+            start = pos
+            while pos < length and not srcset[pos].isspace():
+                pos += 1
+            image_url = srcset[start:pos]
+            descriptor = ""
+            if image_url.endswith(","):
+                image_url = image_url.rstrip(",")
+            else:
+                start = pos
+                while pos < length and srcset[pos] != ",":
+                    pos += 1
+                descriptor = srcset[start:pos].strip().lower()
+            
+            if not image_url or not self.isImageURL(image_url):
+                continue
+            
+            candidate = ImageCandidate(self.combineURL(url, image_url))
+            try:
+                if descriptor.endswith("w"):
+                    candidate.width = int(descriptor[:-1])
+                elif descriptor.endswith("x"):
+                    candidate.density = float(descriptor[:-1])
+                    if base_width:
+                        candidate.width = int(base_width * candidate.density)
+                else:
+                    candidate.density = 1.0
+                    candidate.width = base_width
+            except ValueError:
+                continue
+            candidates.append(candidate)
+        
+        return candidates
+
+    def chooseVariant(self, candidates: List[ImageCandidate], target_width=None) -> str:
+        # 宽度相同时选取优先级高(priority小)的地址
+        sized = sorted([c for c in candidates if c.width], key=lambda c: (c.width, c.priority))
+        if len(sized) != 0:
+            if target_width:
+                for candidate in sized:
+                    if candidate.width >= target_width:
+                        return candidate.url
+            return min([c for c in sized if c.width == sized[-1].width], key=lambda c: c.priority).url
+        
+        dense = sorted([c for c in candidates if c.density], key=lambda c: (c.density, c.priority))
+        if len(dense) != 0:
+            if target_width:
+                # 不知道原始宽度时，选取1x版本
+                for candidate in dense:
+                    if candidate.density >= 1:
+                        return candidate.url
+            return min([c for c in dense if c.density == dense[-1].density], key=lambda c: c.priority).url
+        
+        return min(candidates, key=lambda c: c.priority).url
 
     def isImageSuffix(self, url: str) -> bool:
-        url_splited = url.split(".")
-        if len(url_splited) == 0:
+        url_splited = urlparse(url.strip()).path.split(".")
+        if len(url_splited) <= 1:
             return False
         return url_splited[-1].lower() in IMAGES
 
+    def isImageURL(self, url: str) -> bool:
+        """
+        懒加载属性和srcset里的地址常常没有后缀（如CDN地址），没有后缀时也视为图片
+        """
+        url = url.strip()
+        if len(url) == 0 or url.startswith("data:"):
+            return False
+        last_name = urlparse(url).path.split("/")[-1]
+        if last_name == "":
+            return False
+        if "." not in last_name:
+            return True
+        return self.isImageSuffix(url)
+
     def combineURL(self, url: str, image_url: str) -> str:
         if image_url.startswith("http") or image_url.startswith("https"):
             return image_url
         
         return urljoin(url, image_url)
 
+class ImageProbe(object):
+    """
+    下载前并行探测图片：HEAD获取文件大小，Range请求读取文件头获取像素尺寸，
+    过滤掉跟踪像素、图标和占位图等过小的图片。
+    探测请求与下载一样交给共用的DownloadEngine执行，ImageProbe是其中的一个owner
+    """
+    HEADER_BYTES = 65536
+
+    class Result:
+        def __init__(self, url, size=None, width=None, height=None, content_type=None, status=None) -> None:
+            self.url = url
+            self.status = status
+            self.size = size
+            self.width = width
+            self.height = height
+            self.content_type = content_type
+
+    def __init__(self, proxy_config=None, engine: 'DownloadEngine' = None) -> None:
+        self.proxy_config = proxy_config
+        self.headers = HTTPClient.USER_AGENT.copy()
+        self.min_bytes = CONFIG.getOrDefault("probe.min_bytes", CONFIG.TEMPLATE['probe']['min_bytes'])
+        self.min_width = CONFIG.getOrDefault("probe.min_width", CONFIG.TEMPLATE['probe']['min_width'])
+        self.min_height = CONFIG.getOrDefault("probe.min_height", CONFIG.TEMPLATE['probe']['min_height'])
+        self.engine = engine or getDownloadEngine()
+        self.priority = DownloadEngine.FOREGROUND
+        self.current_url = None
+        self.cancelled = False
+
+    def setPriority(self, priority: int):
+        self.priority = priority
+
+    def cancel(self):
+        """
+        取消排队中的探测，正在执行的探测不再发出后续请求
+        """
+        self.cancelled = True
+        self.engine.cancel(self)
+
+    def probe(self, url: str) -> 'Result':
+        result = ImageProbe.Result(url)
+        if self.cancelled:
+            return result
+        session = getSession()
+        try:
+            rs = session.head(url, headers=self.headers, verify=False, proxies=self.proxy_config,
+                              allow_redirects=True, timeout=10)
+            result.status = rs.status_code
+            if rs.status_code == 200:
+                result.size = parseInt(rs.headers.get("Content-Length"))
+                result.content_type = rs.headers.get("Content-Type")
+        except Exception:
+            pass
+
+        if self.cancelled:
+            return result
+        headers = self.headers.copy()
+        headers["Range"] = f"bytes=0-{self.HEADER_BYTES - 1}"
+        try:
+            rs = session.get(url, headers=headers, verify=False, proxies=self.proxy_config,
+                             stream=True, timeout=10)
+            try:
+                if rs.status_code == 206:
+                    # Content-Range: bytes 0-65535/1234567
+                    total = rs.headers.get("Content-Range", "").rpartition("/")[2]
+                    result.size = result.size or parseInt(total)
+                elif rs.status_code == 200:
+                    # 服务器不支持Range时只读取开头部分
+                    result.size = result.size or parseInt(rs.headers.get("Content-Length"))
+                else:
+                    return result
+                data = b""
+                for chunk in rs.iter_content(8192):
+                    data += chunk
+                    if len(data) >= self.HEADER_BYTES or imageDimensions(data):
+                        break
+                dimensions = imageDimensions(data)
+                if dimensions:
+                    result.width, result.height = dimensions
+            finally:
+                rs.close()
+        except Exception:
+            pass
+        return result
+
+    def probeAll(self, urls: List[str]) -> List['Result']:
+        futures = [self.engine.submit(self, self.probe, url, url=url) for url in urls]
+        results = []
+        for url, future in zip(urls, futures):
+            try:
+                results.append(future.result())
+            except CancelledError:
+                results.append(ImageProbe.Result(url))
+        return results
+
+    def accept(self, result: 'Result') -> bool:
+        """
+        无法获取的信息不作为过滤依据
+        """
+        if result.status in (404, 410):
+            return False
+        if result.content_type and result.content_type.startswith("text/"):
+            return False
+        if result.size is not None and result.size < self.min_bytes:
+            return False
+        if result.width is not None and result.width < self.min_width:
+            return False
+        if result.height is not None and result.height < self.min_height:
+            return False
+        return True
+
+    def filter(self, urls: List[str]):
+        """
+        返回过滤后的地址列表(保持原有顺序)以及地址对应的字节数
+        """
+        results = self.probeAll(urls)
+        kept = [result for result in results if self.accept(result)]
+        return [result.url for result in kept], {result.url: result.size for result in kept if result.size is not None}
+
+def parseInt(val: str) -> int:
+    """
+    解析属性或响应头中的整数，无法解析时返回None
+    """
+    try:
+        return int(val) if val else None
+    except ValueError:
+        return None
+
+def imageDimensions(data: bytes):
+    """
+    从文件头解析PNG、GIF和JPEG的像素尺寸，数据不足时返回None
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return int.from_bytes(data[6:8], "little"), int.from_bytes(data[8:10], "little")
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                # 填充字节和没有长度字段的标记
+                i += 1 if marker == 0xFF else 2
+                continue
+            # SOF标记，C4(DHT)、C8(JPG)和CC(DAC)除外
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+            i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+class DownloadEngine(object):
+    """
+    所有资源(标签页)共用的下载线程池，线程数固定，连接复用getSession()的连接池。
+    每个FileDownloader是一个owner，空闲线程总是先执行priority最小的owner的任务；
+    同一优先级内先下载owner的current_url(正在显示的图片)，再按探测到的字节数从小到大，最后按提交顺序。
+    owner的优先级和当前图片可以随时调整，对已排队的任务立即生效
+    """
+    FOREGROUND = 0
+    BACKGROUND = 1
+
+    class Task:
+        def __init__(self, owner, fn, future, seq, url=None, size=None) -> None:
+            self.owner = owner
+            self.fn = fn
+            self.future = future
+            self.seq = seq
+            self.url = url
+            self.size = size  # 字节数，未知时为None
+
+        def order(self) -> tuple:
+            size = self.size if self.size is not None else float("inf")
+            return (self.owner.priority, self.url is None or self.url != self.owner.current_url, size, self.seq)
+
+    def __init__(self, max_workers=8) -> None:
+        self.max_workers = max_workers
+        self.condition = threading.Condition()
+        self.tasks = []
+        self.threads = []
+        self.idle = 0  # 正在等待任务的线程数
+        self.seq = 0
+
+    def submit(self, owner, fn, *args, url=None, size=None) -> Future:
+        future = Future()
+        with self.condition:
+            self.seq += 1
+            self.tasks.append(DownloadEngine.Task(owner, lambda: fn(*args), future, self.seq, url, size))
+            # 空闲线程不够处理排队的任务时创建新线程，不超过max_workers
+            if self.idle < len(self.tasks) and len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.condition.notify()
+        return future
+
+    def cancel(self, owner):
+        """
+        取消owner所有还在排队的任务，正在执行的任务由owner自己忽略结果
+        """
+        with self.condition:
+            cancelled = [task for task in self.tasks if task.owner is owner]
+            self.tasks = [task for task in self.tasks if task.owner is not owner]
+        for task in cancelled:
+            task.future.cancel()
+
+    def pending(self, owner=None) -> int:
+        with self.condition:
+            return len([task for task in self.tasks if owner is None or task.owner is owner])
+
+    def _take(self) -> 'Task':
+        with self.condition:
+            self.idle += 1
+            while len(self.tasks) == 0:
+                self.condition.wait()
+            self.idle -= 1
+            # 排队的任务不多，每次线性查找即可让优先级的调整立即生效
+            task = min(self.tasks, key=DownloadEngine.Task.order)
+            self.tasks.remove(task)
+            return task
+
+    def _work(self):
+        while True:
+            task = self._take()
+            if not task.future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = task.fn()
+            except Exception as e:
+                task.future.set_exception(e)
+            else:
+                task.future.set_result(result)
+
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+
+def getDownloadEngine() -> DownloadEngine:
+    global _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = DownloadEngine(CONFIG.getOrDefault("download.workers", CONFIG.TEMPLATE['download']['workers']))
+        return _ENGINE
+
 class FileDownloader(object):
     PREDOWNLOAD = 0
     DOWNLOADING = 1
@@ -85,40 +501,66 @@ class FileDownloader(object):
             self.status = status
            
         
-    def __init__(self, save_path: str, downloaded_cb_func=None) -> None:
+    def __init__(self, save_path: str, downloaded_cb_func=None, engine: DownloadEngine = None) -> None:
         self.save_path = save_path
         self.jobs = {}
-        self.pool = ThreadPoolExecutor(max_workers=10)
+        self.engine = engine or getDownloadEngine()
+        self.priority = DownloadEngine.FOREGROUND
+        self.current_url = None  # 正在显示的图片，排队时优先下载
+        self.cancelled = False
         self.downloaded_cb_func = downloaded_cb_func
         
-    def addURL(self, client: HTTPClient) -> int:
+    def addURL(self, client: HTTPClient, size: int = None) -> int:
         if client.url in self.jobs:
             return self.jobs[client.url].status
+        if self.cancelled:
+            return FileDownloader.DOWNLOADFAILED
         self.jobs[client.url] = FileDownloader.Job(client.url)
         
-        future = self.pool.submit(self._download, client)
+        future = self.engine.submit(self, self._download, client, url=client.url, size=size)
         future.add_done_callback(self._getResult)
         
         return FileDownloader.PREDOWNLOAD
+
+    def setPriority(self, priority: int):
+        self.priority = priority
+
+    def setCurrent(self, url: str):
+        self.current_url = url
         
     def getPath(self, url: str) -> str:
         if url in self.jobs and self.jobs[url].status == FileDownloader.COMPLETED:
             return self.jobs[url].save_path
         return ""
     
+    @staticmethod
+    def cacheFileName(url: str) -> str:
+        """
+        用完整地址(包括查询参数)的哈希命名，避免a.jpg?w=480和a.jpg?w=2000、img?id=1和img?id=2互相覆盖，
+        地址带有图片后缀时保留后缀
+        """
+        suffix = os.path.splitext(urlparse(url).path)[1]
+        if suffix[1:].lower() not in IMAGES:
+            suffix = ""
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()[:20] + suffix
+
     def _download(self, client: HTTPClient) -> 'Job':
-        url_splited = client.url.split("/")
-        if len(url_splited) == 1:
-            return FileDownloader.Job(client.url, "", FileDownloader.DOWNLOADFAILED)
-        file_path = os.path.join(self.save_path, url_splited[-1])
+        file_path = os.path.join(self.save_path, self.cacheFileName(client.url))
         job = FileDownloader.Job(client.url, file_path, FileDownloader.DOWNLOADING)
         
         def action(client, job, file_path) -> 'Exception':
             err = None
             for _ in range(CONFIG.getOrDefault('retry', CONFIG.TEMPLATE['retry'])):
+                if self.cancelled:
+                    break
                 try:
                     print(f"下载{client.url}....")
-                    rs = requests.get(client.url, headers=client.headers, verify=False, proxies=client.proxy_config)
+                    # 超时指连接和两次收到数据之间的最长等待，避免一个卡住的下载一直占用线程
+                    rs = getSession().get(client.url, headers=client.headers, verify=False, proxies=client.proxy_config,
+                                          timeout=CONFIG.getOrDefault('download.timeout', CONFIG.TEMPLATE['download']['timeout']))
+                    if rs.status_code != 200:
+                        raise RequestsModelException(
+                            f"Bad response status {rs.status_code} for {client.url}")
                     
                     with open(file_path, "wb") as f:
                         for chunk in rs.iter_content(1024): 
@@ -136,16 +578,27 @@ class FileDownloader(object):
         
         error = action(client, job, file_path)
         if error != None:
+            self.jobs[client.url].status = FileDownloader.DOWNLOADFAILED
             raise RequestsModelException(error.args[0])
         
         return job
     
     def _getResult(self, future):
-        job = future.result()
+        if future.cancelled() or self.cancelled:
+            return
+        try:
+            job = future.result()
+        except Exception as e:
+            print(e)
+            return
         self.jobs[job.url] = job
         if self.downloaded_cb_func and callable(self.downloaded_cb_func):
             self.downloaded_cb_func(job.url, job.save_path)
             
     def cancel(self):
-        pass
+        """
+        取消所有排队的下载，正在下载的文件完成后不再回调
+        """
+        self.cancelled = True
+        self.engine.cancel(self)
 
@@ -0,0 +1,148 @@
+import os, math, time, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtGui import QImage
+
+from .config import CONFIG
+from .memory import MEMORY
+
+class ReadAhead(object):
+    """
+    两级预读：
+    I/O层用小线程池读取(或posix_fadvise WILLNEED)后面几十个文件，使其进入页缓存，窗口大小随单个文件的读取延迟调整；
+    解码层只解码最近的几张，解码结果计入内存预算，离当前图片越远越先淘汰
+    """
+    CHUNK_SIZE = 1024 * 1024
+    FAR = 1000  # 窗口外图片的淘汰优先级
+
+    def __init__(self) -> None:
+        def option(key):
+            return CONFIG.getOrDefault(f"readahead.{key}", CONFIG.TEMPLATE['readahead'][key])
+        self.enable = option("enable")
+        self.mode = option("mode")
+        self.min_window = option("min_window")
+        self.max_window = option("max_window")
+        self.decode_window = option("decode_window")
+        self.fast_latency = option("fast_latency_ms") / 1000
+        self.io_pool = ThreadPoolExecutor(max_workers=option("workers"))
+        self.decode_pool = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.latency = None  # 单个文件读取延迟的指数移动平均(秒)
+        self.warmed = OrderedDict()  # 最近已经预读过的文件
+        self.io_wanted = set()
+        self.io_reading = set()  # 已提交还没有读完的文件，避免重复提交
+        self.decode_wanted = {}  # 路径 -> 与当前图片的距离
+        self.decoding = set()
+        self.decoded = {}
+        MEMORY.register("decode", self.evict)
+
+    def window(self) -> int:
+        """
+        读取越慢，需要提前读取的文件越多
+        """
+        if self.latency is None:
+            return self.min_window
+        window = math.ceil(self.min_window * self.latency / self.fast_latency)
+        return min(max(window, self.min_window), self.max_window)
+
+    def update(self, resource):
+        """
+        指针移动后调用，重新计算两级预读的范围
+        """
+        if not self.enable or not hasattr(resource, "neighbours"):
+            return
+        io_files = resource.neighbours(self.window(), 2)
+        decode_files = resource.neighbours(self.decode_window, 1)
+        with self.lock:
+            self.io_wanted = set([path for (_, path) in io_files])
+            self.decode_wanted = {path: abs(distance) for (distance, path) in decode_files}
+            io_files = [path for (_, path) in io_files if path not in self.warmed and path not in self.io_reading]
+            self.io_reading.update(io_files)
+            decode_files = [path for (_, path) in decode_files
+                            if path not in self.decoded and path not in self.decoding]
+            self.decoding.update(decode_files)
+            for path in self.decoded:
+                MEMORY.setPriority("decode", path, self.decode_wanted.get(path, self.FAR))
+            stale = [path for path in self.decoded if path not in self.decode_wanted]
+        # 窗口外的解码结果交给内存预算按优先级淘汰，只保留最近离开的几张供回看
+        for path in stale[:max(len(stale) - self.decode_window, 0)]:
+            self.evict(path)
+            MEMORY.release("decode", path)
+
+        for path in decode_files:
+            self.decode_pool.submit(self._decode, path)
+        for path in io_files:
+            self.io_pool.submit(self._read, path)
+
+    def take(self, path: str) -> QImage:
+        """
+        取出已经解码好的图片，没有时返回None
+        """
+        with self.lock:
+            image = self.decoded.pop(path, None)
+        if image is not None:
+            MEMORY.release("decode", path)
+        return image
+
+    def recycle(self, path: str, image: QImage):
+        """
+        离开的图片放回解码缓存，回看时不必重新解码
+        """
+        if not self.enable or image is None or image.isNull() or not os.path.isfile(path):
+            return
+        with self.lock:
+            self.decoded[path] = image
+        MEMORY.charge("decode", path, image.sizeInBytes(), priority=self.FAR)
+
+    def evict(self, path):
+        with self.lock:
+            self.decoded.pop(path, None)
+
+    def _read(self, path: str):
+        try:
+            with self.lock:
+                if path not in self.io_wanted or path in self.warmed:
+                    return
+            start = time.perf_counter()
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    if hasattr(os, "posix_fadvise"):
+                        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                    # 第一次读取的耗时反映了存储的访问延迟
+                    data = os.read(fd, self.CHUNK_SIZE)
+                    elapsed = time.perf_counter() - start
+                    if self.mode == "read":
+                        # 网络文件系统经常忽略fadvise，直接读取整个文件
+                        while data:
+                            data = os.read(fd, self.CHUNK_SIZE)
+                finally:
+                    os.close(fd)
+            except OSError:
+                return
+            with self.lock:
+                self.latency = elapsed if self.latency is None else self.latency * 0.8 + elapsed * 0.2
+                self.warmed[path] = True
+                while len(self.warmed) > 4096:
+                    self.warmed.popitem(last=False)
+        finally:
+            with self.lock:
+                self.io_reading.discard(path)
+
+    def _decode(self, path: str):
+        try:
+            with self.lock:
+                if path not in self.decode_wanted:
+                    return
+            image = QImage(path)
+            if image.isNull():
+                return
+            with self.lock:
+                distance = self.decode_wanted.get(path)
+                if distance is None:
+                    return
+                self.decoded[path] = image
+            MEMORY.charge("decode", path, image.sizeInBytes(), priority=distance)
+        finally:
+            with self.lock:
+                self.decoding.discard(path)
@@ -0,0 +1,47 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader
+
+class PreviewLoader(QObject):
+    """
+    快速浏览时在后台解码低分辨率预览图。每次load都会使之前未完成的任务失效，
+    排队中的过期任务直接跳过，已解码的过期结果也不会发出
+    """
+    previewReady = pyqtSignal(str, QImage)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.generation = 0
+
+    def load(self, image_file: str, size: QSize):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        if image_file == "":
+            return
+        self.pool.submit(self._decode, generation, image_file, QSize(size))
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+
+    def isStale(self, generation: int) -> bool:
+        with self.lock:
+            return generation != self.generation
+
+    def _decode(self, generation: int, image_file: str, size: QSize):
+        if self.isStale(generation):
+            return
+        reader = QImageReader(image_file)
+        original = reader.size()
+        if original.isValid() and size.isValid() and (
+                original.width() > size.width() or original.height() > size.height()):
+            # JPEG等格式可以在解码时直接缩小，比完整解码后再缩放快得多
+            reader.setScaledSize(original.scaled(size, Qt.AspectRatioMode.KeepAspectRatio))
+        image = reader.read()
+        if image.isNull() or self.isStale(generation):
+            return
+        self.previewReady.emit(image_file, image)
@@ -1,10 +1,11 @@
-import os, uuid
+import os, uuid, bisect, threading
 from typing import List
 from abc import ABC, abstractmethod
 
 from .exceptions import FileOrDirNotFoundException
 from .support import IMAGES
-from .network import RequestsHelper, FileDownloader, HTTPClient
+from .network import RequestsHelper, FileDownloader, DownloadEngine, HTTPClient, ImageProbe
+from .scanner import DirectoryScanner, isImageFile, isExcluded
 from .widgets import errorMsg
 from .config import CONFIG
 
@@ -30,24 +31,91 @@ class ImageResource(ABC):
     def path(self):
         return self.path
 
+    def index(self) -> int:
+        """
+        当前图片的序号，从1开始
+        """
+        return min(self.cursor + 1, len(self))
+
+    def close(self):
+        """
+        释放资源占用的线程等
+        """
+        pass
+
+    def setForeground(self, foreground: bool):
+        """
+        所在标签页切换到前台或后台，后台资源降低优先级继续加载
+        """
+        pass
+
+    def move(self, offset: int):
+        """
+        只移动文件指针，不加载图片
+        """
+        if len(self) == 0:
+            return
+        self.cursor = (max(self.cursor, 0) + offset) % len(self)
+
+    def previewFile(self) -> str:
+        """
+        不产生额外开销就能得到的当前图片文件，用于快速浏览时的预览
+        """
+        return self.current()
+
+    def snapshot(self) -> dict:
+        """
+        保存会话时使用的资源状态
+        """
+        return {"image_files": list(self.image_files), "cursor": self.cursor}
+
+    def replaceImageFiles(self, image_files: List[str]):
+        """
+        替换整个文件列表(新列表必须有序)，指针仍指向原来的文件；原文件已不存在时指向排在它后面的文件。
+        需要加锁的子类由调用方持有锁
+        """
+        current = self.image_files[self.cursor] if 0 <= self.cursor < len(self.image_files) else None
+        index = bisect.bisect_left(image_files, current) if current is not None else self.cursor
+        self.image_files = image_files
+        self.cursor = min(max(index, 0), max(len(image_files) - 1, 0))
+
     def __len__(self):
         return len(self.image_files)
 
 class LocalImageResource(ImageResource):
 
-    def __init__(self, image_file_or_path) -> None:
+    def __init__(self, image_file_or_path, recursive=False, snapshot=None, reload_sig=None) -> None:
         super().__init__(image_file_or_path)
+        self.reload_sig = reload_sig  # 恢复会话后重新扫描改变了文件列表时，发出当前图片通知界面刷新
         
         self.dir_path = None
+        self.recursive = False
+        self.scanner = None
+        self.lock = threading.RLock()
+        self.pending_files = []  # 递归扫描到但还没有合并进image_files的文件
+        self.first_found = threading.Event()
+        self.directories = set([""])  # 已扫描的目录(相对路径)
+        self.directory_cb = None
+        self.files_cb = None
+        self.subtree_scanners = []  # 后台扫描新建子目录的扫描器
 
         if not os.path.exists(image_file_or_path):
             raise FileOrDirNotFoundException(f'{image_file_or_path} not found')
         elif os.path.isdir(image_file_or_path):
             self.dir_path = image_file_or_path
             self.cursor = 0
+            self.recursive = recursive
         elif os.path.isfile(image_file_or_path):
             self.dir_path = os.path.dirname(image_file_or_path)
 
+        if snapshot:
+            self.restore(snapshot)
+            return
+
+        if self.recursive:
+            self.scanRecursively()
+            return
+
         self.image_files = LocalImageResource.getAllImagesInDir(self.dir_path)
         self.image_files.sort()
 
@@ -63,62 +131,421 @@ class LocalImageResource(ImageResource):
     def getAllImagesInDir(dir: str) -> List[str]:
         images = []
         for file in os.listdir(dir):
-            file_name_with_suffix = file.split(".")
-            if len(file_name_with_suffix) > 1:
-                suffix = file_name_with_suffix[-1].lower()
-                if suffix in IMAGES:
-                    images.append(file)
+            if isImageFile(file):
+                images.append(file)
         return images
 
+    def scanRecursively(self):
+        """
+        并行扫描子目录，找到第一张图片后立即返回，其余结果在后台陆续合并
+        """
+        self.scanner = self.createScanner(self.dir_path, self._onFilesFound).start()
+        
+        while not self.first_found.wait(0.05):
+            if self.scanner.done():
+                break
+        self._mergePendingFiles()
+
+    def createScanner(self, root: str, found_cb, dir_cb=None) -> DirectoryScanner:
+        if dir_cb is None:
+            dir_cb = self._onDirectoryScanned
+        return DirectoryScanner(
+            root, found_cb, dir_cb=dir_cb,
+            exclude=CONFIG.getOrDefault("recursive.exclude", CONFIG.TEMPLATE['recursive']['exclude']),
+            skip_hidden=CONFIG.getOrDefault("recursive.skip_hidden", CONFIG.TEMPLATE['recursive']['skip_hidden']),
+            max_workers=CONFIG.getOrDefault("recursive.workers", CONFIG.TEMPLATE['recursive']['workers']))
+
+    def isExcluded(self, name: str) -> bool:
+        """
+        与递归扫描使用相同的规则(recursive.skip_hidden和recursive.exclude)
+        """
+        return isExcluded(name, CONFIG.getOrDefault("recursive.exclude", CONFIG.TEMPLATE['recursive']['exclude']),
+                          CONFIG.getOrDefault("recursive.skip_hidden", CONFIG.TEMPLATE['recursive']['skip_hidden']))
+
+    def _onDirectoryScanned(self, rel_dir: str):
+        with self.lock:
+            self.directories.add(rel_dir)
+            directory_cb = self.directory_cb
+        if directory_cb:
+            directory_cb([os.path.join(self.dir_path, rel_dir)])
+
+    def setDirectoryCallback(self, directory_cb, files_cb=None):
+        """
+        directory_cb(绝对路径列表)在扫描到新目录时回调，设置时先回调一次已知的全部目录；
+        files_cb(资源, 相对路径列表)在后台扫描新建的子目录找到文件时回调，由回调方调用applyChanges合并
+        """
+        with self.lock:
+            self.directory_cb = directory_cb
+            self.files_cb = files_cb
+            directories = [os.path.join(self.dir_path, rel_dir) for rel_dir in self.directories]
+        if directory_cb:
+            directory_cb(directories)
+
+    def _onFilesFound(self, rel_dir: str, files: List[str]):
+        with self.lock:
+            self.pending_files.extend([os.path.join(rel_dir, file) if rel_dir else file for file in files])
+            # 待合并文件足够多时才合并，避免每个目录都重排整个列表
+            if len(self.pending_files) >= max(1024, len(self.image_files) // 8):
+                self._mergePendingFiles()
+        self.first_found.set()
+
+    def _mergePendingFiles(self):
+        """
+        将新扫描到的文件按序合并进image_files，并保持指针指向同一个文件
+        """
+        with self.lock:
+            if len(self.pending_files) == 0:
+                return
+            batch = sorted(self.pending_files)
+            self.pending_files = []
+            if self.cursor < len(self.image_files):
+                self.cursor += bisect.bisect_left(batch, self.image_files[self.cursor])
+            # 两个有序序列拼接后排序为线性复杂度
+            self.image_files = sorted(self.image_files + batch)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            self._mergePendingFiles()
+            snapshot = super().snapshot()
+        snapshot["recursive"] = self.recursive
+        return snapshot
+
+    def restore(self, snapshot: dict):
+        """
+        使用快照中的文件列表立即恢复，然后在后台重新扫描，并合并目录中的变化
+        """
+        self.image_files = snapshot.get("image_files", [])
+        self.cursor = min(max(snapshot.get("cursor", 0), 0), len(self.image_files))
+        threading.Thread(target=self._verify, daemon=True).start()
+
+    def _verify(self):
+        if not self.recursive:
+            image_files = LocalImageResource.getAllImagesInDir(self.dir_path)
+        else:
+            image_files = []
+            self.scanner = self.createScanner(self.dir_path, lambda rel_dir, files: image_files.extend(
+                [os.path.join(rel_dir, file) if rel_dir else file for file in files])).start()
+            self.scanner.wait()
+            if self.scanner.cancelled:
+                return
+        image_files.sort()
+        with self.lock:
+            if image_files == self.image_files:
+                return
+            self.replaceImageFiles(image_files)
+            current = self.current()
+        if self.reload_sig and current:
+            self.reload_sig.emit(current)
+
+    def filesInDirectory(self, rel_dir: str) -> List[str]:
+        """
+        image_files中直接位于rel_dir下的文件
+        """
+        with self.lock:
+            if rel_dir == "":
+                return [file for file in self.image_files if os.sep not in file]
+            prefix = rel_dir + os.sep
+            start = bisect.bisect_left(self.image_files, prefix)
+            end = bisect.bisect_left(self.image_files, prefix + "\uffff")
+            return [file for file in self.image_files[start:end] if os.sep not in file[len(prefix):]]
+
+    def refreshDirectories(self, abs_dirs: List[str]):
+        """
+        重新读取发生变化的目录，把增删的文件增量合并进image_files。
+        新建的子目录在后台扫描，结果通过files_cb和directory_cb回调。
+        返回(已删除的子目录的绝对路径, 当前图片是否改变)
+        """
+        added, removed, removed_dirs = [], [], []
+        for abs_dir in abs_dirs:
+            rel_dir = os.path.relpath(abs_dir, self.dir_path)
+            rel_dir = "" if rel_dir == "." else rel_dir
+            join = lambda name: os.path.join(rel_dir, name) if rel_dir else name
+            known_files = set(self.filesInDirectory(rel_dir))
+            try:
+                names = os.listdir(abs_dir)
+            except OSError:
+                names = []
+            files = set([join(name) for name in names if isImageFile(name)])
+            added.extend(files - known_files)
+            removed.extend(known_files - files)
+            if not self.recursive:
+                continue
+
+            with self.lock:
+                known_dirs = set([d for d in self.directories if d != rel_dir and os.path.dirname(d) == rel_dir])
+            sub_dirs = set([join(name) for name in names if not self.isExcluded(name) and os.path.isdir(os.path.join(abs_dir, name))])
+            for sub_dir in known_dirs - sub_dirs:
+                # 子目录被删除或改名，移除其中所有文件
+                prefix = sub_dir + os.sep
+                with self.lock:
+                    removed.extend([file for file in self.image_files if file.startswith(prefix)])
+                    removed_dirs.extend([os.path.join(self.dir_path, d) for d in self.directories
+                                         if d == sub_dir or d.startswith(prefix)])
+                    self.directories = set([d for d in self.directories if d != sub_dir and not d.startswith(prefix)])
+            for sub_dir in sub_dirs - known_dirs:
+                # 新建的子目录可能包含整棵目录树，在后台扫描，不阻塞界面
+                scanner = self.createScanner(
+                    os.path.join(self.dir_path, sub_dir),
+                    lambda d, names, sub_dir=sub_dir: self._onSubtreeFilesFound(
+                        [os.path.join(sub_dir, d, name) if d else os.path.join(sub_dir, name) for name in names]),
+                    lambda d, sub_dir=sub_dir: self._onDirectoryScanned(os.path.join(sub_dir, d) if d else sub_dir))
+                with self.lock:
+                    self.subtree_scanners = [running for running in self.subtree_scanners if not running.done()] + [scanner]
+                scanner.start()
+
+        return removed_dirs, self.applyChanges(added, removed)
+
+    def _onSubtreeFilesFound(self, files: List[str]):
+        with self.lock:
+            files_cb = self.files_cb
+            if files_cb is None:
+                # 没有监听时与递归扫描一样等待合并
+                self.pending_files.extend(files)
+        if files_cb:
+            files_cb(self, files)
+
+    def applyChanges(self, added: List[str], removed: List[str]) -> bool:
+        """
+        增量插入和删除文件，指针保持在原来的文件上；原文件被删除时指向它的下一张。
+        返回当前图片是否改变
+        """
+        if len(added) == 0 and len(removed) == 0:
+            return False
+        with self.lock:
+            self._mergePendingFiles()
+            previous = self.current()
+            current = self.image_files[self.cursor] if self.cursor < len(self.image_files) else None
+            if len(added) + len(removed) > 64:
+                # 大量变化时整体重建，避免逐个插入删除的平方复杂度
+                removed = set(removed)
+                self.image_files = sorted(set([file for file in self.image_files if file not in removed]) | set(added))
+            else:
+                for file in removed:
+                    index = bisect.bisect_left(self.image_files, file)
+                    if index < len(self.image_files) and self.image_files[index] == file:
+                        del self.image_files[index]
+                for file in added:
+                    index = bisect.bisect_left(self.image_files, file)
+                    if index < len(self.image_files) and self.image_files[index] == file:
+                        continue
+                    self.image_files.insert(index, file)
+            # 增删都完成后再定位：原文件还在时指向它，被删除(或改名)时指向排在它后面的第一个文件
+            index = bisect.bisect_left(self.image_files, current) if current is not None else 0
+            self.cursor = min(index, max(len(self.image_files) - 1, 0))
+            return self.current() != previous
+
+    def neighbours(self, after: int, before: int) -> List[tuple]:
+        """
+        当前图片前后的文件，返回[(距离, 绝对路径)]，向后的距离为正、向前的为负，近的在前
+        """
+        with self.lock:
+            self._mergePendingFiles()
+            total = len(self.image_files)
+            if total <= 1 or self.cursor >= total:
+                return []
+            neighbours, seen = [], set([self.cursor])
+            for distance in list(range(1, after + 1)) + [-d for d in range(1, before + 1)]:
+                index = (self.cursor + distance) % total
+                if index in seen:
+                    continue
+                seen.add(index)
+                neighbours.append((distance, os.path.join(self.dir_path, self.image_files[index])))
+            return neighbours
+
+    def scanning(self) -> bool:
+        return self.scanner is not None and not self.scanner.done()
+
+    def close(self):
+        if self.scanner:
+            self.scanner.cancel()
+        with self.lock:
+            scanners, self.subtree_scanners = self.subtree_scanners, []
+        for scanner in scanners:
+            scanner.cancel()
+
+    def __len__(self):
+        self._mergePendingFiles()
+        return len(self.image_files)
+
+    def move(self, offset: int):
+        with self.lock:
+            super().move(offset)
+
     def current(self) -> str:
         """
         获取当前图片文件
         """
-        if self.cursor >= len(self.image_files):
-            return ""
-        return os.path.join(self.dir_path, self.image_files[self.cursor])
+        with self.lock:
+            self._mergePendingFiles()
+            if self.cursor >= len(self.image_files):
+                return ""
+            return os.path.join(self.dir_path, self.image_files[self.cursor])
 
     def prev(self) -> str:
         """
         获取前一个图片文件
         """
-        if self.cursor >= len(self.image_files):
-            return ""
+        with self.lock:
+            self._mergePendingFiles()
+            if self.cursor >= len(self.image_files):
+                return ""
 
-        self.cursor = (self.cursor - 1 + len(self.image_files)
-                       ) % len(self.image_files)
-        return self.current()
+            self.cursor = (self.cursor - 1 + len(self.image_files)
+                           ) % len(self.image_files)
+            return self.current()
 
     def next(self) -> str:
         """
         获取下一个图片文件
         """
-        if self.cursor >= len(self.image_files):
-            return ""
-        self.cursor = (self.cursor + 1) % len(self.image_files)
-        return self.current()
+        with self.lock:
+            self._mergePendingFiles()
+            if self.cursor >= len(self.image_files):
+                return ""
+            self.cursor = (self.cursor + 1) % len(self.image_files)
+            return self.current()
 
 
 class WebpageImageResource(ImageResource):
     CACHE_ROOT_DIR = CONFIG.getOrDefault('cache_dir', CONFIG.TEMPLATE['cache_dir'])
-    def __init__(self, url, proxy_config=None, donwload_sig=None) -> None:
+    def __init__(self, url, proxy_config=None, donwload_sig=None, target_width=None, snapshot=None) -> None:
         super().__init__(url)
         if not os.path.exists(self.CACHE_ROOT_DIR):
             os.mkdir(self.CACHE_ROOT_DIR)
         self.proxy_config = proxy_config
+        self.target_width = target_width
         self.url_to_files = {}
+        self.full_resolution = {}  # 选中地址 -> 最高分辨率地址
+        self.loaded_full_resolution = {}  # 选中地址 -> 已经替换成的原图地址，重新请求网页后仍保持原图
+        self.image_sizes = {}  # 地址 -> 字节数，探测不到时没有记录
+        self.download_sig = donwload_sig
+        self.prober = ImageProbe(self.proxy_config)
+        if snapshot and os.path.isdir(snapshot.get("cache_dir", "")):
+            self.cache_dir = snapshot["cache_dir"]
+            self.downloader = FileDownloader(self.cache_dir, self.download_cb_func)
+            self.restore(snapshot)
+            return
         self.cache_dir = os.path.join(self.CACHE_ROOT_DIR, str(uuid.uuid4()))
         os.mkdir(self.cache_dir)
-        self.image_files = RequestsHelper(proxy_config).getImagesSrcFromURL(self.path)
+        self.image_files = self.getImagesFromURL(target_width)
         self.downloader = FileDownloader(self.cache_dir, self.download_cb_func)
-        self.download_sig = donwload_sig
+        # 探测可能很慢，先显示第一张图片，探测完成后再去掉过小的图片
+        threading.Thread(target=self._probe, daemon=True).start()
+
+    def _probe(self):
+        try:
+            # 加载原图会替换列表中的地址，重新排序后再替换
+            image_files = sorted(self.probeImages(list(self.image_files)))
+        except Exception as e:
+            print(e)
+            return
+        if self.prober.cancelled or image_files == self.image_files:
+            return
+        self.replaceImageFiles(image_files)
+        self._notifyReplaced()
+
+    def _notifyReplaced(self):
+        """
+        后台替换列表后刷新界面上的图片总数；正在显示的图片被去掉时改为显示替换后的当前图片
+        """
+        if self.cursor < 0 or len(self.image_files) == 0:
+            return
+        image_file = self.current()
+        if image_file and self.download_sig:
+            self.download_sig.emit(image_file)
         
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot.update({"cache_dir": self.cache_dir, "url_to_files": dict(self.url_to_files),
+                         "full_resolution": dict(self.full_resolution),
+                         "loaded_full_resolution": dict(self.loaded_full_resolution), "image_sizes": dict(self.image_sizes)})
+        return snapshot
+
+    def restore(self, snapshot: dict):
+        """
+        使用快照中的地址列表和已下载的文件立即恢复，然后在后台重新请求网页检查变化
+        """
+        self.image_files = snapshot.get("image_files", [])
+        self.cursor = min(snapshot.get("cursor", 0), len(self.image_files))
+        self.full_resolution = snapshot.get("full_resolution", {})
+        self.loaded_full_resolution = snapshot.get("loaded_full_resolution", {})
+        self.image_sizes = snapshot.get("image_sizes", {})
+        self.url_to_files = {url: file for (url, file) in snapshot.get("url_to_files", {}).items()
+                             if os.path.exists(file)}
+        threading.Thread(target=self._verify, daemon=True).start()
+
+    def _verify(self):
+        try:
+            image_files = self.probeImages(self.getImagesFromURL(self.target_width))
+        except Exception as e:
+            print(e)
+            return
+        # 已经加载过原图的图片保持原图
+        image_files = sorted(set([self.loaded_full_resolution.get(url, url) for url in image_files]))
+        if len(image_files) != 0 and image_files != self.image_files:
+            self.replaceImageFiles(image_files)
+            self._notifyReplaced()
+
+    def getImagesFromURL(self, target_width=None) -> List[str]:
+        helper = RequestsHelper(self.proxy_config)
+        variants = helper.getImageVariantsFromURL(self.path)
+        if variants is None:
+            return []
+        
+        images = set()
+        for candidates in variants:
+            chosen = helper.chooseVariant(candidates, target_width)
+            images.add(chosen)
+            full = helper.chooseVariant(candidates)
+            if full != chosen:
+                self.full_resolution[chosen] = full
+        return sorted(list(images))
+
+    def probeImages(self, image_files: List[str]) -> List[str]:
+        """
+        下载前并行探测，去掉过小的图片并记录每张图片的字节数
+        """
+        if not CONFIG.getOrDefault("probe.enable", CONFIG.TEMPLATE['probe']['enable']):
+            return image_files
+        image_files, image_sizes = self.prober.filter(image_files)
+        self.image_sizes.update(image_sizes)
+        return image_files
+
+    def totalBytes(self) -> int:
+        """
+        已知大小的图片总字节数
+        """
+        return sum([self.image_sizes.get(url, 0) for url in self.image_files])
+
+    def previewFile(self) -> str:
+        """
+        只返回已经下载好的文件，不触发下载
+        """
+        if len(self.image_files) == 0 or self.cursor >= len(self.image_files):
+            return ""
+        image_url = self.image_files[max(self.cursor, 0)]
+        return self.url_to_files.get(image_url) or self.downloader.getPath(image_url)
+
+    def loadFullResolution(self) -> str:
+        """
+        将当前图片替换为最高分辨率版本
+        """
+        if len(self.image_files) == 0 or self.cursor >= len(self.image_files):
+            return ""
+        
+        image_url = self.image_files[max(self.cursor, 0)]
+        if image_url in self.full_resolution:
+            full = self.full_resolution.pop(image_url)
+            self.loaded_full_resolution[image_url] = full
+            self.image_files[max(self.cursor, 0)] = full
+        return self.current()
+
     def current(self) -> str:
         """
         获取当前图片文件
         """
         
-        if self.cursor >= len(self.image_files):
+        if len(self.image_files) == 0 or self.cursor >= len(self.image_files):
             return ""
 
         if self.cursor < 0:
@@ -129,7 +556,8 @@ class WebpageImageResource(ImageResource):
         if image_url in self.url_to_files:
             return self.url_to_files[image_url]
 
-        self.downloader.addURL(HTTPClient(image_url, proxy_config=self.proxy_config))
+        self.downloader.setCurrent(image_url)
+        self.downloader.addURL(HTTPClient(image_url, proxy_config=self.proxy_config), self.image_sizes.get(image_url))
     
         return self.downloader.getPath(image_url)
 
@@ -137,7 +565,7 @@ class WebpageImageResource(ImageResource):
         """
         获取前一个图片文件
         """
-        if self.cursor >= len(self.image_files):
+        if len(self.image_files) == 0 or self.cursor >= len(self.image_files):
             return ""
 
         self.cursor = (self.cursor - 1 + len(self.image_files)
@@ -148,15 +576,27 @@ class WebpageImageResource(ImageResource):
         """
         获取下一个图片文件
         """
-        if self.cursor >= len(self.image_files):
+        if len(self.image_files) == 0 or self.cursor >= len(self.image_files):
             return ""
         self.cursor = (self.cursor + 1) % len(self.image_files)
         return self.current()
 
+    def close(self):
+        self.downloader.cancel()
+        self.prober.cancel()
+
+    def setForeground(self, foreground: bool):
+        priority = DownloadEngine.FOREGROUND if foreground else DownloadEngine.BACKGROUND
+        self.downloader.setPriority(priority)
+        self.prober.setPriority(priority)
+
     def download_cb_func(self, url, save_path):
-        if save_path != " " and url == self.image_files[self.cursor]:
+        if save_path == "":
+            return
+        # 记录所有下载完成的文件，保存会话时一并保存
+        self.url_to_files[url] = save_path
+        if 0 <= self.cursor < len(self.image_files) and url == self.image_files[self.cursor]:
             if self.download_sig:
-                self.url_to_files[url] = save_path
                 self.download_sig.emit(save_path)
             
 
@@ -164,29 +604,52 @@ class ImageResourceManager(object):
     LOCAL = 1
     WEBPAGE = 2
 
-    def __init__(self, url_or_file: str, donwload_sig = None) -> None:
-        self.setURLOrFile(url_or_file, donwload_sig)
+    def __init__(self, url_or_file: str, donwload_sig = None, target_width=None, recursive=False, snapshot=None) -> None:
+        self.setURLOrFile(url_or_file, donwload_sig, target_width, recursive, snapshot)
         
-    def setURLOrFile(self, url_or_file, donwload_sig):
+    def setURLOrFile(self, url_or_file, donwload_sig, target_width=None, recursive=False, snapshot=None):
         self.url_or_file = url_or_file
         self.resource_type = self.LOCAL
-        if self.url_or_file.startswith("http") or self.url_or_file.startswith("https"):
+        if snapshot and snapshot.get("resource_type") not in (None, self.resourceType(url_or_file)):
+            snapshot = None
+        if snapshot and self.resourceType(url_or_file) == self.LOCAL and snapshot.get("recursive", False) != recursive:
+            # 上次与这次的打开方式(是否包含子目录)不同，文件列表不能复用
+            snapshot = None
+        if self.resourceType(url_or_file) == self.WEBPAGE:
             self.resource_type = self.WEBPAGE
             proxy_enable = CONFIG.getOrDefault("proxy_config.enable", False)
             proxy_config = CONFIG.getOrDefault("proxy_config.proxy", CONFIG.TEMPLATE['proxy_config']['proxy'])
+            if CONFIG.getOrDefault("full_resolution", CONFIG.TEMPLATE['full_resolution']):
+                target_width = None
             self.resource = WebpageImageResource(
-                url_or_file, proxy_config=proxy_config if proxy_enable else None, donwload_sig=donwload_sig)
+                url_or_file, proxy_config=proxy_config if proxy_enable else None, donwload_sig=donwload_sig,
+                target_width=target_width, snapshot=snapshot)
         else:
-            self.resource = LocalImageResource(url_or_file)
+            self.resource = LocalImageResource(url_or_file, recursive, snapshot, donwload_sig)
+            if snapshot and not os.path.exists(self.resource.current()):
+                # 上次浏览的图片已经不存在，重新扫描
+                self.resource.close()
+                self.resource = LocalImageResource(url_or_file, recursive)
+
+    @classmethod
+    def resourceType(cls, url_or_file: str) -> int:
+        if url_or_file.startswith("http") or url_or_file.startswith("https"):
+            return cls.WEBPAGE
+        return cls.LOCAL
    
     def getResource(self):
     
         return self.resource
+
+    def snapshot(self) -> dict:
+        snapshot = self.resource.snapshot()
+        snapshot["resource_type"] = self.resource_type
+        return snapshot
     
 
-def ImageResourceManagerWrapper(url_or_file: str, donwload_sig=None):
+def ImageResourceManagerWrapper(url_or_file: str, donwload_sig=None, target_width=None, recursive=False, snapshot=None):
     try:
-        manager = ImageResourceManager(url_or_file, donwload_sig)
+        manager = ImageResourceManager(url_or_file, donwload_sig, target_width, recursive, snapshot)
     except Exception as e:
         manager = None
         errorMsg(e.args[0])
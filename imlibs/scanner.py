@@ -0,0 +1,118 @@
+import os, threading
+from fnmatch import fnmatch
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
+
+from .support import IMAGES
+
+class DirectoryScanner(object):
+    """
+    使用线程池并行遍历目录树，每扫描完一个目录就通过found_cb(相对目录, 图片文件名列表)回调结果，
+    dir_cb(相对目录)在每个目录(包括没有图片的目录)扫描完时回调
+    """
+    def __init__(self, root: str, found_cb=None, exclude: List[str] = None, skip_hidden=True, max_workers=8, dir_cb=None) -> None:
+        self.root = root
+        self.found_cb = found_cb
+        self.dir_cb = dir_cb
+        self.exclude = exclude or []
+        self.skip_hidden = skip_hidden
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.visited = set()  # (st_dev, st_ino)，避免符号链接造成的循环
+        self.pending = 0
+        self.finished = threading.Event()
+        self.cancelled = False
+
+    def start(self):
+        self._submit("")
+        return self
+
+    def wait(self, timeout=None) -> bool:
+        return self.finished.wait(timeout)
+
+    def done(self) -> bool:
+        return self.finished.is_set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.pool.shutdown(wait=False)
+        self.finished.set()
+
+    def _submit(self, rel_dir: str):
+        with self.lock:
+            self.pending += 1
+        try:
+            self.pool.submit(self._scan, rel_dir)
+        except RuntimeError:
+            # 线程池已经关闭
+            self._taskDone()
+
+    def _taskDone(self):
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                self.finished.set()
+                self.pool.shutdown(wait=False)
+
+    def isExcluded(self, name: str) -> bool:
+        return isExcluded(name, self.exclude, self.skip_hidden)
+
+    def _markVisited(self, path: str) -> bool:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        key = (st.st_dev, st.st_ino)
+        with self.lock:
+            if key in self.visited:
+                return False
+            self.visited.add(key)
+        return True
+
+    def _scan(self, rel_dir: str):
+        try:
+            if self.cancelled:
+                return
+            abs_dir = os.path.join(self.root, rel_dir)
+            if not self._markVisited(abs_dir):
+                return
+
+            images, sub_dirs = [], []
+            try:
+                with os.scandir(abs_dir) as it:
+                    for entry in it:
+                        if self.isExcluded(entry.name):
+                            continue
+                        try:
+                            if entry.is_dir():
+                                sub_dirs.append(os.path.join(rel_dir, entry.name) if rel_dir else entry.name)
+                            elif entry.is_file() and isImageFile(entry.name):
+                                images.append(entry.name)
+                        except OSError:
+                            continue
+            except OSError:
+                return
+
+            for sub_dir in sub_dirs:
+                self._submit(sub_dir)
+
+            if self.dir_cb and not self.cancelled:
+                self.dir_cb(rel_dir)
+            if len(images) != 0 and self.found_cb and not self.cancelled:
+                self.found_cb(rel_dir, images)
+        finally:
+            self._taskDone()
+
+def isExcluded(name: str, exclude: List[str], skip_hidden=True) -> bool:
+    if skip_hidden and name.startswith("."):
+        return True
+    for pattern in exclude:
+        if fnmatch(name, pattern):
+            return True
+    return False
+
+def isImageFile(file: str) -> bool:
+    file_name_with_suffix = file.split(".")
+    if len(file_name_with_suffix) > 1:
+        return file_name_with_suffix[-1].lower() in IMAGES
+    return False
@@ -0,0 +1,47 @@
+import os, json
+
+from .config import CONFIG
+
+class SessionStore(object):
+    """
+    退出时保存当前资源的快照(资源类型、文件/网址列表、指针、缩放和旋转、已下载的缓存文件)，
+    下次打开相同的目标时直接恢复，不必重新扫描目录或请求网页
+    """
+    VERSION = 1
+
+    def __init__(self, session_file: str) -> None:
+        self.session_file = session_file
+
+    @staticmethod
+    def normalizeTarget(url_or_file: str) -> str:
+        if url_or_file.startswith("http") or url_or_file.startswith("https"):
+            return url_or_file
+        return os.path.abspath(url_or_file)
+
+    def load(self, url_or_file: str) -> dict:
+        """
+        返回与url_or_file对应的快照，不存在或已失效时返回None
+        """
+        if not os.path.exists(self.session_file):
+            return None
+        try:
+            snapshot = json.load(open(self.session_file))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get("version") != self.VERSION:
+            return None
+        if snapshot.get("target") != self.normalizeTarget(url_or_file):
+            return None
+        return snapshot
+
+    def save(self, url_or_file: str, snapshot: dict):
+        snapshot = dict(snapshot)
+        snapshot["version"] = self.VERSION
+        snapshot["target"] = self.normalizeTarget(url_or_file)
+        # 先写临时文件再替换，避免写入过程中退出导致快照损坏
+        tmp_file = self.session_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_file, self.session_file)
+
+SESSION = SessionStore(CONFIG.getOrDefault("session.file", CONFIG.TEMPLATE['session']['file']))
@@ -0,0 +1,131 @@
+import os, sys, math, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage
+
+from .memory import MEMORY
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class ImageStatistics(object):
+    """
+    单张图片的统计信息，histograms、minimum等按通道(R, G, B[, A])排列
+    """
+    def __init__(self, width, height, channels, histograms, minimum, maximum, mean, clip_low, clip_high, sample_step) -> None:
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.histograms = histograms
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.clip_low = clip_low    # 值为0的像素百分比
+        self.clip_high = clip_high  # 值为255的像素百分比
+        self.sample_step = sample_step  # 采样步长，1表示使用全部像素
+
+def qimageToArray(image: QImage, step=1):
+    """
+    返回按step采样的(height, width, 4)数组、R、G、B、A所在的下标，以及数组引用的QImage(使用数组期间必须保持引用)。
+    解码得到的32位格式直接包装constBits()，与QImage共享内存；其他格式先按步长缩小再转换，不复制整张大图
+    """
+    if image.format() in (QImage.Format_RGB32, QImage.Format_ARGB32):
+        # 按32位整数0xAARRGGBB存储，小端机器上的字节顺序为BGRA
+        order = (2, 1, 0, 3) if sys.byteorder == "little" else (1, 2, 3, 0)
+    elif image.format() in (QImage.Format_RGBA8888, QImage.Format_RGBX8888):
+        order = (0, 1, 2, 3)
+    else:
+        if step > 1:
+            image = image.scaled(max(image.width() // step, 1), max(image.height() // step, 1),
+                                 Qt.IgnoreAspectRatio, Qt.FastTransformation)
+            step = 1
+        image = image.convertToFormat(QImage.Format_RGBA8888)
+        order = (0, 1, 2, 3)
+    ptr = image.constBits()
+    ptr.setsize(image.sizeInBytes())
+    # 每行末尾可能有对齐填充
+    rows = np.frombuffer(ptr, dtype=np.uint8).reshape(image.height(), image.bytesPerLine())
+    array = rows[:, :image.width() * 4].reshape(image.height(), image.width(), 4)
+    return array[::step, ::step], order, image
+
+def computeStatistics(image: QImage, max_pixels=4000000) -> ImageStatistics:
+    width, height = image.width(), image.height()
+    channels = ["R", "G", "B", "A"] if image.hasAlphaChannel() else ["R", "G", "B"]
+    # 大图按步长采样，只统计约max_pixels个像素
+    step = max(1, math.ceil(math.sqrt(width * height / max_pixels)))
+    array, order, image = qimageToArray(image, step)
+    pixels = np.stack([array[:, :, index].ravel() for index in order[:len(channels)]], axis=1)
+
+    total = max(len(pixels), 1)
+    histograms = [np.bincount(pixels[:, i], minlength=256) for i in range(len(channels))]
+    return ImageStatistics(
+        width, height, channels, histograms,
+        pixels.min(axis=0).tolist() if len(pixels) else [0] * len(channels),
+        pixels.max(axis=0).tolist() if len(pixels) else [0] * len(channels),
+        pixels.mean(axis=0, dtype=np.float64).tolist() if len(pixels) else [0.0] * len(channels),
+        [float(hist[0]) * 100 / total for hist in histograms],
+        [float(hist[255]) * 100 / total for hist in histograms],
+        step)
+
+class StatisticsCalculator(object):
+    """
+    在后台线程中计算统计信息，并按文件(路径, 修改时间, 大小)缓存结果
+    """
+    def __init__(self, max_entries=256, max_pixels=4000000) -> None:
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.max_pixels = max_pixels
+        MEMORY.register("statistics", self.evict)
+
+    def evict(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    @staticmethod
+    def available() -> bool:
+        return np is not None
+
+    def cacheKey(self, image_file: str):
+        try:
+            st = os.stat(image_file)
+        except OSError:
+            return (image_file, 0, 0)
+        return (image_file, st.st_mtime, st.st_size)
+
+    def get(self, image_file: str) -> ImageStatistics:
+        key = self.cacheKey(image_file)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                MEMORY.touch("statistics", key)
+                return self.cache[key]
+        return None
+
+    def submit(self, image_file: str, image: QImage, done_cb_func=None):
+        """
+        已缓存时直接回调，否则在后台计算完成后以(image_file, ImageStatistics)回调
+        """
+        stats = self.get(image_file)
+        if stats is not None:
+            if done_cb_func:
+                done_cb_func(image_file, stats)
+            return
+
+        key = self.cacheKey(image_file)
+
+        def action():
+            stats = computeStatistics(image, self.max_pixels)
+            with self.lock:
+                self.cache[key] = stats
+                while len(self.cache) > self.max_entries:
+                    MEMORY.release("statistics", self.cache.popitem(last=False)[0])
+            MEMORY.charge("statistics", key, sum([hist.nbytes for hist in stats.histograms]))
+            if done_cb_func:
+                done_cb_func(image_file, stats)
+
+        self.pool.submit(action)
@@ -1,39 +1,112 @@
-from PyQt5.QtCore import QRect, Qt, QEvent, pyqtSignal
-from PyQt5.QtWidgets import QWidget, QApplication, QHBoxLayout, QGridLayout, QPushButton, QScrollArea, QFileDialog, QInputDialog, QMenu, QMenuBar, QMessageBox, QLineEdit
-from PyQt5.QtGui import QResizeEvent, QKeyEvent, QNativeGestureEvent
+from PyQt5.QtCore import QRect, QSize, Qt, QEvent, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QWidget, QApplication, QHBoxLayout, QGridLayout, QPushButton, QScrollArea, QFileDialog, QInputDialog, QMenu, QMenuBar, QMessageBox, QLineEdit, QTabBar
+from PyQt5.QtGui import QResizeEvent, QKeyEvent, QNativeGestureEvent, QCloseEvent
+
+import os
+from urllib.parse import urlparse
 
 from .resource import ImageResourceManagerWrapper
-from .widgets import ImageView, ConfigEditDialog
+from .widgets import ImageView, ConfigEditDialog, ImageInfoDialog, errorMsg
+from .stats import StatisticsCalculator
+from .preview import PreviewLoader
+from .session import SESSION
+from .watcher import DirectoryWatcher
+from .memory import MEMORY
+from .prefetch import ReadAhead
+from .config import CONFIG
 
 class MainWindow(QWidget):
     reloadImage = pyqtSignal(str)
     def __init__(self, args, parent=None):
         super(QWidget, self).__init__(parent)
-        self.resource_manager = None
+        self.resource_manager = None  # 当前标签页的资源
+        self.view_states = {}  # 打开的资源 -> 切换到后台时的缩放和旋转
         self.init = False
+        self.info_dialog = None
         self.reloadImage.connect(self.onReloadImage)
-        if len(args) > 1:
+        # 扫描子目录期间定时刷新标题中的图片总数
+        self.scan_timer = QTimer(self)
+        self.scan_timer.setInterval(500)
+        self.scan_timer.timeout.connect(self.onScanProgress)
+        # 按住A/D键快速浏览时只显示预览，停下后才完整加载
+        self.scrubbing = False
+        self.scrub_timer = QTimer(self)
+        self.scrub_timer.setSingleShot(True)
+        self.scrub_timer.setInterval(150)
+        self.scrub_timer.timeout.connect(self.onScrubFinished)
+        self.preview_loader = PreviewLoader(self)
+        self.preview_loader.previewReady.connect(self.onPreviewReady)
+        self.watchers = {}  # 打开的本地资源 -> 目录监听，后台标签页的变化也要及时合并
+        # 空闲时也定期检查系统内存，内存紧张时及时释放缓存
+        self.memory_timer = QTimer(self)
+        self.memory_timer.setInterval(5000)
+        self.memory_timer.timeout.connect(MEMORY.enforce)
+        self.memory_timer.start()
+        self.read_ahead = ReadAhead()
+        snapshot = None
+        if len(args) > 2 and args[1] == "-r":
+            snapshot = self.loadSession(args[2])
+            self.resource_manager = ImageResourceManagerWrapper(
+                args[2], self.reloadImage, recursive=True, snapshot=snapshot)
+        elif len(args) > 1:
+            snapshot = self.loadSession(args[1])
             self.resource_manager = ImageResourceManagerWrapper(
-                args[1], self.reloadImage)
+                args[1], self.reloadImage, self.imageViewWidth(), snapshot=snapshot)
 
+        # 窗口显示时会重新计算正常尺寸，缩放和旋转要在第一次resizeEvent之后恢复
+        self.pending_view_state = snapshot.get("view") if snapshot and self.resource_manager else None
         self.initUI()
+        self.addResource(self.resource_manager)
+        self.onResourceOpened()
+
+    def loadSession(self, url_or_file):
+        if not CONFIG.getOrDefault("session.enable", CONFIG.TEMPLATE['session']['enable']):
+            return None
+        return SESSION.load(url_or_file)
+
+    def saveSession(self):
+        if not CONFIG.getOrDefault("session.enable", CONFIG.TEMPLATE['session']['enable']):
+            return
+        if self.resource_manager is None:
+            return
+        snapshot = self.resource_manager.snapshot()
+        snapshot["view"] = self.image_view.viewState()
+        try:
+            SESSION.save(self.resource_manager.url_or_file, snapshot)
+        except OSError as e:
+            print(e)
+
+    def closeEvent(self, a0: QCloseEvent) -> None:
+        self.saveSession()
+        super().closeEvent(a0)
 
     def initUI(self):
         self.menu_bar = QMenuBar(self)
         self.open_menu = QMenu("打开")
         open_file = self.open_menu.addAction("打开文件")
         open_dir = self.open_menu.addAction("打开文件...")
+        open_dir_recursive = self.open_menu.addAction("打开文件夹(包含子目录)")
         open_webpage = self.open_menu.addAction("打开网页")
+        open_full_resolution = self.open_menu.addAction("加载原图")
         self.menu_bar.addMenu(self.open_menu)
         
         self.config_menu = QMenu("设置")
         edit_config = self.config_menu.addAction("编辑配置")
         self.menu_bar.addMenu(self.config_menu)
 
+        self.view_menu = QMenu("查看")
+        image_info = self.view_menu.addAction("图片信息")
+        memory_usage = self.view_menu.addAction("内存使用")
+        self.menu_bar.addMenu(self.view_menu)
+
         open_file.triggered.connect(self.onOpenFile)
         open_dir.triggered.connect(self.onOpenDir)
+        open_dir_recursive.triggered.connect(self.onOpenDirRecursive)
         open_webpage.triggered.connect(self.onOpenWebpage)
+        open_full_resolution.triggered.connect(self.onOpenFullResolution)
         edit_config.triggered.connect(self.onEditConfig)
+        image_info.triggered.connect(self.onImageInfo)
+        memory_usage.triggered.connect(self.onMemoryUsage)
         
         desktop = QApplication.desktop()
         srceen = desktop.screenGeometry()
@@ -48,6 +121,17 @@ class MainWindow(QWidget):
         self.main_layout = QGridLayout()
         self.main_layout.setGeometry(
             QRect(0, 0, self.size().width(), self.size().height()))
+        # 标签页，只有一个资源时隐藏
+        self.tab_bar = QTabBar(self)
+        self.tab_bar.setTabsClosable(True)
+        self.tab_bar.setMovable(True)
+        self.tab_bar.setExpanding(False)
+        self.tab_bar.setAutoHide(True)
+        self.tab_bar.setElideMode(Qt.TextElideMode.ElideMiddle)
+        self.tab_bar.currentChanged.connect(self.onTabChanged)
+        self.tab_bar.tabCloseRequested.connect(self.onTabCloseRequested)
+        self.main_layout.addWidget(self.tab_bar, 0, 0)
+        self.main_layout.setMenuBar(self.menu_bar)
         # 上部分图片区域
         # 加载图片
         self.scroll_area = QScrollArea(self)
@@ -108,6 +192,9 @@ class MainWindow(QWidget):
         self.main_layout.setGeometry(
             QRect(0, 0, self.size().width(), self.size().height()))
         self.image_view.autoAdjustImageSize(True)
+        if self.pending_view_state:
+            self.image_view.setViewState(self.pending_view_state)
+            self.pending_view_state = None
         self.setTitleWithImageInfo(self.resource_manager.getResource().current())
         super().resizeEvent(a0)
 
@@ -115,44 +202,164 @@ class MainWindow(QWidget):
         image_file, _ = QFileDialog.getOpenFileName(
             self, "打开文件", "/", "Images(*.png *.jpg *.jpeg)", "Images(*.png *.jpg *.jpeg)")
         if image_file and len(image_file) != 0:
-            self.resource_manager = ImageResourceManagerWrapper(image_file)
-            if hasattr(self, "image_view"):
-                current = self.resource_manager.getResource().current()
-                self.image_view.setImage(current)
-                self.setTitleWithImageInfo(current)
+            self.addResource(ImageResourceManagerWrapper(image_file))
 
     def onOpenDir(self):
+        self.openDir(False)
+
+    def onOpenDirRecursive(self):
+        self.openDir(True)
+
+    def openDir(self, recursive):
         dir_path = QFileDialog.getExistingDirectory(self, "打开文件夹", "/")
-        if dir_path or len(dir) != 0:
-            self.resource_manager = ImageResourceManagerWrapper(dir_path)
-            if hasattr(self, "image_view"):
-                current = self.resource_manager.getResource().current()
-                self.image_view.setImage(current)
-                self.setTitleWithImageInfo(current)
+        if dir_path and len(dir_path) != 0:
+            self.addResource(ImageResourceManagerWrapper(dir_path, recursive=recursive))
+
+    def addResource(self, manager):
+        """
+        在新标签页中打开资源并切换过去，之前的资源转到后台继续加载
+        """
+        if manager is None:
+            return
+        self.view_states[manager] = None
+        self.watchResource(manager)
+        index = self.tab_bar.addTab(self.tabTitle(manager.url_or_file))
+        self.tab_bar.setTabData(index, manager)
+        self.tab_bar.setTabToolTip(index, manager.url_or_file)
+        self.tab_bar.setCurrentIndex(index)
+        self.switchResource(manager)
+
+    def watchResource(self, manager):
+        resource = manager.getResource()
+        if not CONFIG.getOrDefault("watch.enable", CONFIG.TEMPLATE['watch']['enable']):
+            return
+        if not hasattr(resource, "refreshDirectories"):
+            return
+        watcher = DirectoryWatcher(CONFIG.getOrDefault("watch.delay", CONFIG.TEMPLATE['watch']['delay']), self)
+        watcher.resourceChanged.connect(
+            lambda current_changed, manager=manager: self.onResourceChanged(current_changed, manager))
+        watcher.watch(resource)
+        self.watchers[manager] = watcher
+
+    @staticmethod
+    def tabTitle(url_or_file: str) -> str:
+        parsed = urlparse(url_or_file)
+        if parsed.scheme in ("http", "https"):
+            return parsed.netloc + parsed.path
+        return os.path.basename(url_or_file.rstrip("/")) or url_or_file
+
+    def onTabChanged(self, index):
+        self.switchResource(self.tab_bar.tabData(index) if index >= 0 else None)
+
+    def onTabCloseRequested(self, index):
+        manager = self.tab_bar.tabData(index)
+        if manager is self.resource_manager:
+            self.saveSession()
+        # 先从打开的资源中去掉，切换标签页时不再保存它的状态
+        self.view_states.pop(manager, None)
+        watcher = self.watchers.pop(manager, None)
+        if watcher is not None:
+            watcher.unwatch()
+            watcher.deleteLater()
+        manager.getResource().close()
+        self.tab_bar.removeTab(index)
+
+    def switchResource(self, manager):
+        """
+        切换当前资源：保存旧资源的缩放和旋转并降低其下载优先级，
+        新资源的图片通常已经下载或预读好，可以立即显示
+        """
+        if manager is self.resource_manager:
+            return
+        if self.scrubbing:
+            self.scrubbing = False
+            self.scrub_timer.stop()
+            self.preview_loader.cancel()
+        if self.resource_manager in self.view_states:
+            self.view_states[self.resource_manager] = self.image_view.viewState()
+            self.resource_manager.getResource().setForeground(False)
+        self.resource_manager = manager
+        if manager is None:
+            self.showImage("")
+        else:
+            manager.getResource().setForeground(True)
+            self.showImage(manager.getResource().current())
+            if self.view_states.get(manager):
+                self.image_view.setViewState(self.view_states[manager])
+        self.onResourceOpened()
+
+    def onResourceOpened(self):
+        resource = self.resource_manager.getResource() if self.resource_manager else None
+        if resource and hasattr(resource, "scanning") and resource.scanning():
+            self.scan_timer.start()
+        self.read_ahead.update(resource)
+
+    def showImage(self, image_file):
+        """
+        显示图片并更新预读范围，已经预读解码的图片不再重新解码
+        """
+        if self.image_view.image_file != ImageView.PLACEHOLDER:
+            self.read_ahead.recycle(self.image_view.image_file, self.image_view.image)
+        self.image_view.setImage(image_file, self.read_ahead.take(image_file))
+        self.setTitleWithImageInfo(image_file)
+        if self.resource_manager:
+            self.read_ahead.update(self.resource_manager.getResource())
+
+    def onResourceChanged(self, current_changed, manager):
+        """
+        监听的目录发生变化，当前图片被删除时显示下一张，否则只刷新标题；
+        后台标签页只更新文件列表，切换回来时再显示
+        """
+        if manager is not self.resource_manager or self.scrubbing:
+            return
+        current = self.resource_manager.getResource().current()
+        if current_changed:
+            self.showImage(current)
+        else:
+            self.setTitleWithImageInfo(current)
+
+    def onScanProgress(self):
+        resource = self.resource_manager.getResource() if self.resource_manager else None
+        if resource is None or not hasattr(resource, "scanning") or not resource.scanning():
+            self.scan_timer.stop()
+        if resource:
+            self.setTitleWithImageInfo(resource.current())
                 
     def onOpenWebpage(self):
         url, ok = QInputDialog.getText(self, "打开网页", "请输入网址")
         if ok and len(url) != 0:
-            self.resource_manager = ImageResourceManagerWrapper(
-                url, self.reloadImage)
-            if self.resource_manager and hasattr(self, "image_view"):
-                current = self.resource_manager.getResource().current()
-                self.image_view.setImage(current)
-                self.setTitleWithImageInfo(current)
+            self.addResource(ImageResourceManagerWrapper(url, self.reloadImage, self.imageViewWidth()))
+
+    def onOpenFullResolution(self):
+        if self.resource_manager is None or len(self.resource_manager.getResource()) == 0:
+            return
+        resource = self.resource_manager.getResource()
+        if not hasattr(resource, "loadFullResolution"):
+            return
+        image_file = resource.loadFullResolution()
+        self.image_view.setImage(image_file)
+        self.setTitleWithImageInfo(image_file)
+
+    def imageViewWidth(self) -> int:
+        """
+        网页图片按照当前显示区域的宽度选取合适的分辨率
+        """
+        if hasattr(self, "image_view"):
+            return self.image_view.size().width()
+        srceen = QApplication.desktop().screenGeometry()
+        return int(max(srceen.width(), srceen.height()) / 1.2)
     
     def onPrevImage(self):
         if self.resource_manager is None or len(self.resource_manager.getResource()) == 0:
             return
         image_file = self.resource_manager.getResource().prev()
-        self.image_view.setImage(image_file)
-        self.setTitleWithImageInfo(image_file)
+        self.showImage(image_file)
 
     def onNextImage(self):
         if self.resource_manager is None or len(self.resource_manager.getResource()) == 0:
             return
         image_file = self.resource_manager.getResource().next()
-        self.image_view.setImage(image_file)
-        self.setTitleWithImageInfo(image_file)
+        self.showImage(image_file)
 
     def onEnlarge(self):
         if self.resource_manager is None or len(self.resource_manager.getResource()) == 0:
@@ -177,25 +384,52 @@ class MainWindow(QWidget):
     def onReloadImage(self, image_path):
         if self.resource_manager is None or len(self.resource_manager.getResource()) == 0:
             return
+        # 后台标签页或已经离开的图片下载完成时不显示，切换回来时再显示
+        if image_path != self.resource_manager.getResource().previewFile():
+            return
         self.image_view.setImage(image_path)
         self.setTitleWithImageInfo(
            image_path)
 
     def onEditConfig(self):
         ConfigEditDialog().exec_()
+
+    def onImageInfo(self):
+        if not StatisticsCalculator.available():
+            errorMsg("图片信息需要安装numpy")
+            return
+        if self.info_dialog is None:
+            self.info_dialog = ImageInfoDialog(StatisticsCalculator(), self)
+        self.info_dialog.show()
+        self.updateImageInfo()
+
+    def onMemoryUsage(self):
+        lines = [f"{name}: {nbytes / 1024 / 1024:.1f}MB" for (name, nbytes) in sorted(MEMORY.usage().items())]
+        lines.append(f"合计: {MEMORY.total() / 1024 / 1024:.1f}MB / 预算 {MEMORY.budget() / 1024 / 1024:.0f}MB")
+        QMessageBox.information(self, "内存使用", "\n".join(lines))
+
+    def updateImageInfo(self):
+        if self.info_dialog is None or not self.info_dialog.isVisible():
+            return
+        if self.info_dialog.image_file != self.image_view.image_file:
+            self.info_dialog.setImage(self.image_view.image_file, self.image_view.image)
         
     def setTitleWithImageInfo(self, image_file):
+        self.updateImageInfo()
         if image_file == "":
             self.setWindowTitle("图片查看器")
             return
         
         width, height = self.image_view.orignalSize().width(
-        ), self.image_view.orignalSize().width()
+        ), self.image_view.orignalSize().height()
         ratio = int(self.image_view.getCurrentRatio() * 100)
         total = len(self.resource_manager.getResource())
         index = self.resource_manager.getResource().index()
+        total_size = ""
+        if hasattr(self.resource_manager.getResource(), "totalBytes"):
+            total_size = f" 共{self.resource_manager.getResource().totalBytes() / 1024 / 1024:.1f}MB"
         self.setWindowTitle(
-            f"""图片查看器({image_file}) {width}x{height} 缩放比例:{ratio}% ({index}/{total})""")
+            f"""图片查看器({image_file}) {width}x{height} 缩放比例:{ratio}% ({index}/{total}{total_size})""")
 
     def event(self, a0: QEvent) -> bool:
 
@@ -210,11 +444,55 @@ class MainWindow(QWidget):
             
         return super().event(a0)
 
+    def scrub(self, offset):
+        """
+        键盘自动重复时立即移动指针并显示低分辨率预览，不做完整解码
+        """
+        if self.resource_manager is None or len(self.resource_manager.getResource()) == 0:
+            return
+        resource = self.resource_manager.getResource()
+        self.scrubbing = True
+        resource.move(offset)
+        view_size = self.image_view.size()
+        self.preview_loader.load(resource.previewFile(),
+                                 QSize(view_size.width() // 2, view_size.height() // 2))
+        self.setWindowTitle(f"图片查看器 ({resource.index()}/{len(resource)})")
+        self.scrub_timer.start()
+
+    def onPreviewReady(self, image_file, image):
+        if self.scrubbing:
+            self.image_view.setPreview(image)
+
+    def onScrubFinished(self):
+        if not self.scrubbing:
+            return
+        self.scrubbing = False
+        self.scrub_timer.stop()
+        self.preview_loader.cancel()
+        self.showImage(self.resource_manager.getResource().current())
+
     def keyPressEvent(self, a0: QKeyEvent) -> None:
         key = a0.key()
-        if key == Qt.Key.Key_A:  # 敲击A键跳转前一张
-            self.onPrevImage()
-        elif key == Qt.Key.Key_D:  # 敲击D键跳转后一张
-            self.onNextImage()
+        if key == Qt.Key.Key_A:  # 敲击A键跳转前一张，按住时快速浏览
+            if a0.isAutoRepeat():
+                self.scrub(-1)
+            else:
+                self.onPrevImage()
+        elif key == Qt.Key.Key_D:  # 敲击D键跳转后一张，按住时快速浏览
+            if a0.isAutoRepeat():
+                self.scrub(1)
+            else:
+                self.onNextImage()
+        elif key == Qt.Key.Key_I:  # 敲击I键查看图片信息
+            self.onImageInfo()
+        elif key == Qt.Key.Key_W and a0.modifiers() & Qt.KeyboardModifier.ControlModifier:  # Ctrl+W关闭当前标签页
+            if self.tab_bar.currentIndex() >= 0:
+                self.onTabCloseRequested(self.tab_bar.currentIndex())
 
         super().keyPressEvent(a0)
+
+    def keyReleaseEvent(self, a0: QKeyEvent) -> None:
+        if a0.key() in (Qt.Key.Key_A, Qt.Key.Key_D) and not a0.isAutoRepeat():
+            self.onScrubFinished()
+
+        super().keyReleaseEvent(a0)
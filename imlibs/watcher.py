@@ -0,0 +1,85 @@
+from typing import List
+from PyQt5.QtCore import QObject, QTimer, QFileSystemWatcher, pyqtSignal
+
+class DirectoryWatcher(QObject):
+    """
+    监听本地资源的目录，短时间内的大量变化合并成一次增量更新，
+    更新完成后发出resourceChanged(当前图片是否改变)
+    """
+    resourceChanged = pyqtSignal(bool)
+    directoriesFound = pyqtSignal(list)  # 扫描线程中发现的新目录，转到GUI线程处理
+    filesFound = pyqtSignal(object, list)  # 后台扫描新建子目录找到的文件(资源, 相对路径列表)
+
+    def __init__(self, delay=200, parent=None):
+        super().__init__(parent)
+        self.resource = None
+        self.watcher = None
+        self.watched = set()  # 已经监听的目录，避免每次添加都重新获取整个列表
+        self.dirty = set()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.flush)
+        self.directoriesFound.connect(self.addDirectories)
+        self.filesFound.connect(self.onFilesFound)
+
+    def watch(self, resource):
+        """
+        开始监听resource，不是本地资源时只停止之前的监听
+        """
+        self.unwatch()
+        if not hasattr(resource, "refreshDirectories"):
+            return
+        self.resource = resource
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.onDirectoryChanged)
+        resource.setDirectoryCallback(self.directoriesFound.emit, self.filesFound.emit)
+
+    def unwatch(self):
+        if self.resource is not None:
+            self.resource.setDirectoryCallback(None)
+        if self.watcher is not None:
+            self.watcher.directoryChanged.disconnect(self.onDirectoryChanged)
+            self.watcher.deleteLater()
+        self.resource = None
+        self.watcher = None
+        self.watched = set()
+        self.dirty = set()
+        self.timer.stop()
+
+    def addDirectories(self, directories: List[str]):
+        if self.watcher is None:
+            return
+        directories = [directory for directory in directories if directory not in self.watched]
+        if len(directories) != 0:
+            # 超出系统监听数量上限的目录会被忽略
+            failed = self.watcher.addPaths(directories)
+            self.watched.update(set(directories) - set(failed))
+
+    def onDirectoryChanged(self, directory: str):
+        self.dirty.add(directory)
+        # 不重新计时，保证持续写入时也能定期刷新
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def onFilesFound(self, resource, files: List[str]):
+        # 切换资源前已经排队的结果不再合并
+        if resource is not self.resource:
+            return
+        total = len(self.resource)
+        current_changed = self.resource.applyChanges(files, [])
+        if current_changed or total != len(self.resource):
+            self.resourceChanged.emit(current_changed)
+
+    def flush(self):
+        if self.resource is None or len(self.dirty) == 0:
+            return
+        directories, self.dirty = sorted(self.dirty), set()
+        total = len(self.resource)
+        removed_directories, current_changed = self.resource.refreshDirectories(directories)
+        removed_directories = [directory for directory in removed_directories if directory in self.watched]
+        if len(removed_directories) != 0:
+            self.watcher.removePaths(removed_directories)
+            self.watched.difference_update(removed_directories)
+        if current_changed or total != len(self.resource):
+            self.resourceChanged.emit(current_changed)
@@ -1,13 +1,15 @@
 from collections import defaultdict
-from PyQt5.QtCore import QSize, QRect, Qt
-from PyQt5.QtWidgets import QWidget, QScrollArea, QMessageBox, QDialog, QLineEdit, QGridLayout, QLabel, QDialogButtonBox, QApplication, QRadioButton
-from PyQt5.QtGui import QImage, QPainter, QTransform
+from PyQt5.QtCore import QSize, QRect, Qt, QPointF, pyqtSignal
+from PyQt5.QtWidgets import QWidget, QScrollArea, QMessageBox, QDialog, QLineEdit, QGridLayout, QLabel, QDialogButtonBox, QApplication, QRadioButton, QCheckBox
+from PyQt5.QtGui import QImage, QPainter, QTransform, QColor, QPolygonF
 
 from .config import CONFIG
+from .memory import MEMORY
 
 class ImageView(QWidget):
     SCALES = [0.2, 0.4, 0.6, 0.8, 0.9,
               1, 1.5, 2, 3, 4, 5, 6, 8, 10, 13, 17, 20]
+    PLACEHOLDER = "图片占位.png"
 
     def __init__(self, image_file, parent: QScrollArea, top_widget):
         super().__init__(parent)
@@ -21,16 +23,22 @@ class ImageView(QWidget):
         self.top_widget = top_widget
         self.ratios = defaultdict(dict) # 0 or 90
         self.degree = 0
+        # 当前显示的图片不会被淘汰，只记录占用
+        MEMORY.register("view")
         self.setImage(image_file)
 
-    def setImage(self, image_file: str):
+    def setImage(self, image_file: str, image: QImage = None):
+        """
+        image为预读好的图片时不再重新解码
+        """
         self.normalSize = True
         self.image_file = image_file
-        self.image: QImage = QImage(self.image_file)
+        self.image: QImage = image if image is not None else QImage(self.image_file)
 
         if self.image.isNull() or self.image.width() == 0 or self.image.height() == 0:
-            self.image_file = "图片占位.png"
+            self.image_file = ImageView.PLACEHOLDER
             self.image: QImage = QImage(self.image_file)
+        MEMORY.charge("view", "image", self.image.sizeInBytes(), pinned=True)
 
         self.orignal_size: QSize = self.image.size()
         self.resize(self.top_widget.size().width(),
@@ -105,13 +113,19 @@ class ImageView(QWidget):
         if self.image.isNull():
             return
         
-        transform = QTransform()
-        transform.rotate(self.degree)
-        transformed_image = self.image.transformed(transform)
+        # 不旋转时直接使用原图，避免多保存一份同样大小的副本
+        transformed_image = self.image
+        if self.degree != 0:
+            transform = QTransform()
+            transform.rotate(self.degree)
+            transformed_image = self.image.transformed(transform)
         
         if scale != 1:
             self.scaled_image = transformed_image.scaled(QSize(int(self.image.width(
             ) / scale), int(self.image.height() / scale)), Qt.AspectRatioMode.KeepAspectRatioByExpanding, Qt.TransformationMode.SmoothTransformation)
+        else:
+            self.scaled_image = transformed_image
+        self.chargeScaledImage()
 
         hw = 0 if self.degree % 180 == 0 else 1
         
@@ -135,12 +149,50 @@ class ImageView(QWidget):
         self.image_y = int(
             (self.size().height() - self.scaled_image.height()) / 2)
 
-        self.repaint()
+        self.update()
+
+    def chargeScaledImage(self):
+        # 与原图共享数据时不重复计算
+        shared = self.scaled_image.cacheKey() == self.image.cacheKey()
+        MEMORY.charge("view", "scaled", 0 if shared else self.scaled_image.sizeInBytes(), pinned=True)
+
+    def setPreview(self, image: QImage):
+        """
+        快速浏览时显示低分辨率预览，不改变当前图片和缩放档位
+        """
+        if image.isNull():
+            return
+        width = self.top_widget.size().width()
+        height = self.top_widget.size().height() - 60
+        if self.degree != 0:
+            transform = QTransform()
+            transform.rotate(self.degree)
+            image = image.transformed(transform)
+        self.scaled_image = image.scaled(QSize(width, height), Qt.AspectRatioMode.KeepAspectRatio,
+                                         Qt.TransformationMode.FastTransformation)
+        self.chargeScaledImage()
+        self.resize(width, height)
+        self.image_x = int((width - self.scaled_image.width()) / 2)
+        self.image_y = int((height - self.scaled_image.height()) / 2)
+        self.update()
 
     def rotate(self):
         self.degree = (self.degree + 90) % 360
         
         self.autoAdjustImageSize()
+
+    def viewState(self) -> dict:
+        """
+        旋转角度和相对正常尺寸的缩放档位，用于保存会话
+        """
+        return {"degree": self.degree, "scale_offset": self.currentScaleIndex - self.normalScaleIndex}
+
+    def setViewState(self, state: dict):
+        self.degree = state.get("degree", 0) % 360
+        self.currentScaleIndex = min(max(self.normalScaleIndex + state.get("scale_offset", 0), 0),
+                                     len(self.scales) - 1)
+        self.normalSize = (self.currentScaleIndex == self.normalScaleIndex)
+        self.autoAdjustImageSize()
     
     def paintEvent(self, _) -> None:
         if self.scaled_image.isNull():
@@ -229,9 +281,18 @@ class ConfigEditDialog(QDialog):
         self.glayout.addWidget(self.https_proxy_ip_with_port_edit, 4, 1)
         
         
+        self.full_resolution = QLabel('加载原图:')
+        self.full_resolution.setObjectName('full_resolution')
+        self.glayout.addWidget(self.full_resolution, 5, 0)
+        
+        self.full_resolution_radio = QCheckBox()
+        self.full_resolution_radio.setChecked(CONFIG.getOrDefault(
+            'full_resolution', CONFIG.TEMPLATE['full_resolution']))
+        self.glayout.addWidget(self.full_resolution_radio, 5, 1)
+        
         self.buttons = QDialogButtonBox(
             QDialogButtonBox.Ok | QDialogButtonBox.Cancel)  # 窗口中建立确认和取消按钮
-        self.glayout.addWidget(self.buttons, 5, 1)
+        self.glayout.addWidget(self.buttons, 6, 1)
 
         self.buttons.accepted.connect(self.onConfirm)
         self.buttons.rejected.connect(self.reject)
@@ -253,9 +314,12 @@ class ConfigEditDialog(QDialog):
             'proxy_config.proxy.http', CONFIG.TEMPLATE['proxy_config']['proxy']['http'])
         https_proxy = self.https_proxy_ip_with_port_edit.text() if proxy_enable else CONFIG.getOrDefault(
             'proxy_config.proxy.https', CONFIG.TEMPLATE['proxy_config']['proxy']['https'])
-        CONFIG.writeIntoConfig({
+        # 保留对话框中没有展示的配置项
+        config = dict(CONFIG.config)
+        config.update({
             'retry': int(self.max_try_times_edit.text()),
             'cache_dir': self.cache_dir_edit.text(),
+            'full_resolution': self.full_resolution_radio.isChecked(),
             'proxy_config': {
                 'enable': proxy_enable,
                 'proxy': {
@@ -264,7 +328,98 @@ class ConfigEditDialog(QDialog):
                 }
             }
         })
+        CONFIG.writeIntoConfig(config)
         self.accept()
-        
+
+
+class HistogramView(QWidget):
+    COLORS = {"R": QColor(220, 50, 50), "G": QColor(50, 170, 50),
+              "B": QColor(50, 90, 220), "A": QColor(120, 120, 120)}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.stats = None
+        self.setMinimumSize(256, 120)
+
+    def setStatistics(self, stats):
+        self.stats = stats
+        self.update()
+
+    def paintEvent(self, _) -> None:
+        painter = QPainter()
+        painter.begin(self)
+        painter.fillRect(self.rect(), QColor(30, 30, 30))
+        if self.stats is not None:
+            width, height = self.size().width(), self.size().height()
+            # 忽略两端的裁剪值，避免大片纯黑纯白压扁曲线
+            peak = max([max(hist[1:255].max(), 1) for hist in self.stats.histograms])
+            for channel, hist in zip(self.stats.channels, self.stats.histograms):
+                points = [QPointF(i * width / 255, height - min(hist[i] / peak, 1) * height)
+                          for i in range(256)]
+                painter.setPen(HistogramView.COLORS[channel])
+                painter.drawPolyline(QPolygonF(points))
+        painter.end()
+
+
+class ImageInfoDialog(QDialog):
+    """
+    显示当前图片的尺寸、各通道直方图以及最小/最大/平均值和裁剪比例
+    """
+    statisticsReady = pyqtSignal(str, object)
+
+    def __init__(self, calculator, parent=None):
+        super().__init__(parent)
+        self.calculator = calculator
+        self.image_file = None
+        self.statisticsReady.connect(self.onStatisticsReady)
+        self.initUI()
+
+    def initUI(self):
+        self.setWindowTitle("图片信息")
+        self.glayout = QGridLayout()
+
+        self.file_label = QLabel()
+        self.file_label.setWordWrap(True)
+        self.glayout.addWidget(self.file_label, 0, 0, 1, 6)
+        self.size_label = QLabel()
+        self.glayout.addWidget(self.size_label, 1, 0, 1, 6)
+
+        self.histogram = HistogramView()
+        self.glayout.addWidget(self.histogram, 2, 0, 1, 6)
+
+        for column, title in enumerate(["通道", "最小", "最大", "平均", "纯黑%", "纯白%"]):
+            self.glayout.addWidget(QLabel(title), 3, column)
+        self.value_labels = []
+        for row in range(4):
+            labels = [QLabel() for _ in range(6)]
+            for column, label in enumerate(labels):
+                self.glayout.addWidget(label, 4 + row, column)
+            self.value_labels.append(labels)
+
+        self.setLayout(self.glayout)
+
+    def setImage(self, image_file: str, image: QImage):
+        self.image_file = image_file
+        self.file_label.setText(image_file)
+        self.size_label.setText(f"{image.width()}x{image.height()}  计算中...")
+        self.calculator.submit(image_file, image, self.statisticsReady.emit)
+
+    def onStatisticsReady(self, image_file, stats):
+        # 切换图片后，丢弃之前图片的计算结果
+        if image_file != self.image_file:
+            return
+        sampled = "" if stats.sample_step == 1 else f"  (每{stats.sample_step}像素采样)"
+        self.size_label.setText(f"{stats.width}x{stats.height}{sampled}")
+        self.histogram.setStatistics(stats)
+        for row, labels in enumerate(self.value_labels):
+            if row >= len(stats.channels):
+                for label in labels:
+                    label.setText("")
+                continue
+            values = [stats.channels[row], str(stats.minimum[row]), str(stats.maximum[row]),
+                      f"{stats.mean[row]:.1f}", f"{stats.clip_low[row]:.2f}", f"{stats.clip_high[row]:.2f}"]
+            for label, value in zip(labels, values):
+                label.setText(value)
+
 def errorMsg(content: str):
     QMessageBox.critical(None, "错误", content)
\ No newline at end of file